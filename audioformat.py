@@ -0,0 +1,53 @@
+import struct
+import numpy as np
+
+# Every slice that goes into a SoundFont is converted to this format
+TARGET_SAMPLE_RATE = 44100
+TARGET_SAMPLE_WIDTH = 2  # 16-bit
+TARGET_CHANNELS = 1
+
+def write_wav(path, pcm: np.ndarray, sample_rate: int):
+    """
+    Writes int16 mono PCM as a WAV file: a 44 byte header followed by the PCM straight from the
+    array (or view of one), without copying it.
+    """
+    data_size = len(pcm) * TARGET_SAMPLE_WIDTH
+    block_align = TARGET_CHANNELS * TARGET_SAMPLE_WIDTH
+    header = struct.pack('<4sI4s4sIHHIIHH4sI',
+                         b'RIFF', 36 + data_size, b'WAVE',
+                         b'fmt ', 16, 1, TARGET_CHANNELS, sample_rate, sample_rate * block_align, block_align,
+                         8 * TARGET_SAMPLE_WIDTH,
+                         b'data', data_size)
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(np.ascontiguousarray(pcm, dtype='<i2').data)
+
+def find_silence_splits(pcm: np.ndarray, sample_rate: int, chunk_seconds: float, search_seconds: float = 10,
+                        frame_seconds: float = 0.03):
+    """
+    Splits 16-bit mono PCM into chunks of roughly chunk_seconds, cutting each in the middle of the
+    quietest stretch (by frame RMS energy) within search_seconds of where it would otherwise fall,
+    so that cuts land in pauses between words rather than in the middle of one.
+
+    :return: The (start, end) frame range of every chunk, covering the PCM end to end.
+    """
+    frame_length = max(int(frame_seconds * sample_rate), 1)
+    frame_count = len(pcm) // frame_length
+    energy = np.sqrt(np.mean(np.square(pcm[:frame_count * frame_length].reshape(-1, frame_length), dtype=np.float32), axis=1))
+    # Smooth over a few frames so a single quiet frame inside a word doesn't look like a pause
+    energy = np.convolve(energy, np.ones(5, dtype=np.float32) / 5, mode='same')
+
+    chunk_frames = max(int(chunk_seconds * sample_rate) // frame_length, 1)
+    search_frames = int(search_seconds * sample_rate) // frame_length
+    cuts = [0]
+    while frame_count - cuts[-1] > chunk_frames + search_frames:
+        target = cuts[-1] + chunk_frames
+        low = max(target - search_frames, cuts[-1] + 1)
+        window = energy[low:target + search_frames + 1]
+        # Cut in the middle of the quiet stretch nearest the target
+        quiet = np.concatenate(([False], window <= window.min() + 0.1 * (window.max() - window.min()), [False]))
+        edges = np.flatnonzero(np.diff(quiet.astype(np.int8)))
+        middles = (edges[0::2] + edges[1::2] - 1) // 2
+        cuts.append(low + int(middles[np.argmin(np.abs(low + middles - target))]))
+    bounds = [cut * frame_length for cut in cuts] + [len(pcm)]
+    return list(zip(bounds[:-1], bounds[1:]))
@@ -0,0 +1,194 @@
+import asyncio
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from scratch import Scratch
+
+# Jobs run at most this many at a time; the rest wait in a queue of at most MAX_QUEUED_JOBS
+WORKER_COUNT = int(os.getenv("SLICER_WORKERS", 2))
+MAX_QUEUED_JOBS = int(os.getenv("SLICER_MAX_QUEUED_JOBS", 100))
+# A job nobody has asked about for this many seconds is assumed abandoned and cancelled
+ABANDON_AFTER = float(os.getenv("SLICER_ABANDON_AFTER", 120))
+# Finished jobs are forgotten after this many seconds
+FINISHED_JOB_TTL = 60 * 60
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    """
+    One run of a pipeline coroutine function, called with the job itself followed by args, so it
+    can report on itself. Whatever it returns ends up in result; if it raises, the message ends
+    up in error.
+
+    The pipeline reports its progress by publishing events (dicts), which anyone can follow as
+    they happen. stage() times a stage of the pipeline and publishes its start and duration.
+    Events may be published from worker threads as well as the event loop.
+
+    Scratch files the job creates are tracked in scratch, and deleted once it has finished.
+    """
+    __slots__ = ("id", "function", "args", "status", "result", "error", "created", "finished", "last_seen",
+                 "events", "changed", "loop", "scratch")
+
+    def __init__(self, function, args):
+        self.id = uuid.uuid4().hex
+        self.function = function
+        self.args = args
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created = time.monotonic()
+        self.finished = None
+        self.last_seen = self.created
+        self.events = []
+        self.changed = asyncio.Event()  # replaced by a fresh one every time an event is published
+        self.loop = asyncio.get_running_loop()
+        self.scratch = Scratch()
+
+    def seen(self):
+        # Called whenever someone asks after the job, to show it still has an audience
+        self.last_seen = time.monotonic()
+
+    def publish(self, **event):
+        self.events.append({"time": round(time.monotonic() - self.created, 3), **event})
+        self.loop.call_soon_threadsafe(self.notify)
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    @contextmanager
+    def stage(self, name: str):
+        self.publish(stage=name, state="started")
+        started = time.perf_counter()
+        yield
+        self.finish_stage(name, time.perf_counter() - started)
+
+    def finish_stage(self, name: str, seconds: float, **details):
+        # Stage durations are printed too, so they end up in the server logs
+        print(f"Job {self.id}: {name} took {seconds:.3f}s")
+        self.publish(stage=name, state="done", seconds=round(seconds, 3), **details)
+
+    async def follow(self, keepalive: float = 15):
+        """
+        Yields every event the job has published and then each new one as it comes, until the
+        job is finished. Yields None after keepalive seconds without an event.
+        """
+        index = 0
+        while True:
+            changed = self.changed
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.finished is not None:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class JobQueue:
+    """
+    Runs jobs on a fixed pool of worker tasks, in the order they were submitted, so however many
+    users upload at once only worker_count pipelines are ever in progress. The pipelines keep
+    their blocking work on threads (see serve), so the event loop stays free to answer status
+    polls and downloads.
+
+    A job that no one has polled for abandon_after seconds, because the browser was closed,
+    is cancelled rather than run to the end.
+    """
+    def __init__(self, worker_count: int = WORKER_COUNT, max_queued: int = MAX_QUEUED_JOBS,
+                 abandon_after: float = ABANDON_AFTER):
+        self.worker_count = worker_count
+        self.max_queued = max_queued
+        self.abandon_after = abandon_after
+        self.jobs = {}
+        self.queue = None
+        self.workers = []
+
+    async def start(self):
+        # Called from the app's startup hook, so the workers run on the server's event loop
+        self.queue = asyncio.Queue(self.max_queued)
+        self.workers = [asyncio.create_task(self.work()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def submit(self, function, *args) -> Job:
+        self.forget_finished()
+        job = Job(function, args)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFull(f"{self.max_queued} jobs are already waiting")
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Job:
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.seen()
+        return job
+
+    def position(self, job: Job) -> int:
+        # How many queued jobs are ahead of this one, for the status panel
+        return sum(1 for other in self.jobs.values() if other.status == QUEUED and other.created < job.created)
+
+    def forget_finished(self):
+        now = time.monotonic()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished is not None and now - job.finished > FINISHED_JOB_TTL:
+                del self.jobs[job_id]
+
+    async def work(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.run(job)
+            finally:
+                self.queue.task_done()
+
+    async def run(self, job: Job):
+        if time.monotonic() - job.last_seen > self.abandon_after:
+            job.status, job.error = FAILED, "Abandoned before it started"
+            job.finished = time.monotonic()
+            job.publish(state=job.status, error=job.error)
+            await asyncio.to_thread(job.scratch.cleanup)
+            return
+
+        job.status = RUNNING
+        job.publish(state=RUNNING)
+        task = asyncio.ensure_future(job.function(job, *job.args))
+        try:
+            while not (await asyncio.wait({task}, timeout=1))[0]:
+                if time.monotonic() - job.last_seen > self.abandon_after:
+                    print(f"Job {job.id} abandoned, cancelling")
+                    task.cancel()
+                    break
+            job.result = await task
+            job.status = DONE
+        except asyncio.CancelledError:
+            job.status, job.error = FAILED, "Cancelled"
+            if not task.cancelled():
+                raise  # the worker itself is being stopped
+        except Exception as e:
+            print(f"Job {job.id} failed: {type(e).__name__}: {e}")
+            job.status, job.error = FAILED, str(e)
+        finally:
+            task.cancel()
+            await asyncio.to_thread(job.scratch.cleanup)
+            job.finished = time.monotonic()
+            job.publish(state=job.status, error=job.error)
+
+
+# The queue the web app submits to
+JOBS = JobQueue()
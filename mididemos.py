@@ -1,5 +1,5 @@
 from midiutil import MIDIFile
-from soundfonts import SoundFont
+from soundfonts import SoundFont, select_preset
 import math
 from pathlib import Path
 
@@ -14,19 +14,23 @@ def create_demo_midi_files(sf: SoundFont, start_note: int, sf2_path: Path):
     channel = 0
     volume = 100
 
-    samples = []
+    # Samples past note 127 live in further presets/banks, so each note needs its zone's preset too
+    notes = []
     for preset in sf.presets:
         for instrument in preset.instruments:
             for zone in instrument.zones:
-                samples.append(zone.sample)
+                notes.append((preset, zone.root_key, zone.sample))
 
     # Get the directory of the SF2 file using pathlib
     output_dir = Path(sf2_path).parent
     
     # Create original MIDI file
-    for i, sample in enumerate(samples):
-        pitch = min(start_note + i, 127)  # Ensure pitch is within MIDI range (0-127)
-        
+    current_preset = None
+    for preset, pitch, sample in notes:
+        if preset is not current_preset:
+            select_preset(midi, track, channel, time, preset)
+            current_preset = preset
+
         # Calculate duration in quarter notes
         duration_seconds = sample.sample_length / sample.sample_rate
         duration_quarter_notes = duration_seconds / (60 / tempo)
@@ -45,9 +49,12 @@ def create_demo_midi_files(sf: SoundFont, start_note: int, sf2_path: Path):
     midi_quantized.addTempo(track, 0, tempo)
 
     time = 0
-    for i, sample in enumerate(samples):
-        pitch = min(start_note + i, 127)
-        
+    current_preset = None
+    for preset, pitch, sample in notes:
+        if preset is not current_preset:
+            select_preset(midi_quantized, track, channel, math.ceil(time * 2) / 2, preset)
+            current_preset = preset
+
         duration_seconds = sample.sample_length / sample.sample_rate
         duration_quarter_notes = duration_seconds / (60 / tempo)
         
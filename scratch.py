@@ -0,0 +1,53 @@
+import os
+import time
+import shutil
+import tempfile
+from pathlib import Path
+
+# Every scratch directory we create is named with this prefix, so leftovers can be found again
+SCRATCH_PREFIX = "slicer-"
+# Scratch older than this can't belong to a job still running, and is swept up (see sweep_scratch)
+SCRATCH_MAX_AGE = float(os.getenv("SLICER_SCRATCH_MAX_AGE_HOURS", 6)) * 60 * 60
+
+
+class Scratch:
+    """
+    The scratch files and directories one job creates along the way: the upload, the working
+    directory with the .sf2 and MIDI demos, the slices zip... Everything tracked is deleted by
+    cleanup(), which the job queue calls as soon as the job has finished, however it finished.
+    Anything worth keeping has been copied to output/ by then (see staticfiles).
+    """
+    __slots__ = ("paths",)
+
+    def __init__(self):
+        self.paths = []
+
+    def track(self, path) -> Path:
+        self.paths.append(Path(path))
+        return Path(path)
+
+    def mkdtemp(self) -> Path:
+        return self.track(tempfile.mkdtemp(prefix=SCRATCH_PREFIX))
+
+    def cleanup(self):
+        while self.paths:
+            path = self.paths.pop()
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+
+
+def sweep_scratch(directory=None, max_age: float = SCRATCH_MAX_AGE):
+    """
+    Deletes scratch directories left behind by jobs that never got to clean up after themselves,
+    because the server was killed or crashed in the middle of them.
+    """
+    now = time.time()
+    for path in Path(directory or tempfile.gettempdir()).glob(f"{SCRATCH_PREFIX}*"):
+        try:
+            if now - path.stat().st_mtime > max_age:
+                print(f"Removing stale scratch directory {path}")
+                shutil.rmtree(path, ignore_errors=True)
+        except FileNotFoundError:
+            continue  # swept by another process
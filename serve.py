@@ -1,18 +1,28 @@
 import os
-import tempfile
+import json
+import time
+import asyncio
 from pathlib import Path
-from shutil import copyfile
+from shutil import copyfile, make_archive, rmtree
 from fasthtml.common import *
-from staticfiles import store_static_file  # Import the staticfiles module
-from transcribe import transcribe_audio  # Import the transcribe module
-from slice import slice_audio_by_words  # Import the slice module
-from soundfonts import create_sf2_json_file, create_sf2_from_json
+from staticfiles import OUTPUT_DIR, content_etag, etag_matches, evict_static_files, is_immutable, store_static_file, touch_static_file  # Import the staticfiles module
+from transcribe import get_backend, stream_transcription  # Import the transcribe module
+from slice import export_slices, slice_word_stream  # Import the slice module
+from soundfonts import create_slice_zone, create_slicer_soundfont, rebuild_sf2, write_sf2_file
 from mididemos import create_demo_midi_files
+from jobs import DONE, FAILED, JOBS, QueueFull
+from uploads import UploadRejected, receive_upload
+from scratch import Scratch, sweep_scratch
 
-# Initialize FastHTML app with Bootstrap CSS
+# Initialize FastHTML app with Bootstrap CSS.
+# The transcription backend is created at startup, so a local model is loaded before the first upload.
+# htmx is configured to show 4xx responses too, so rejected uploads explain themselves.
+# Scratch left behind by a previous run is swept up, and expired downloads evicted, at startup too
 app, rt = fast_app(hdrs=(
     Link(rel="stylesheet", href="https://maxcdn.bootstrapcdn.com/bootstrap/4.5.2/css/bootstrap.min.css"),
-))
+    Meta(name="htmx-config", content='{"responseHandling": [{"code": "204", "swap": false}, {"code": "[23]..", "swap": true}, '
+                                     '{"code": "4..", "swap": true, "error": true}, {"code": "...", "swap": false}]}'),
+), on_startup=[get_backend, JOBS.start, sweep_scratch, evict_static_files], on_shutdown=[JOBS.stop, lambda: get_backend().close()])
 
 # Define the home route
 @rt('/')
@@ -40,6 +50,12 @@ def home():
                             ),
                             cls="mb-4"
                         ),
+                        # Word slices are only written out as WAV files when asked for
+                        Div(
+                            Input(type="checkbox", id="export_slices", name="export_slices", value="1"),
+                            Label("Also download the word slices as WAV files", for_="export_slices", cls="ml-2"),
+                            cls="mb-4"
+                        ),
                         Input(type="file", name="audio_file", accept="audio/*", id="audio-input"),
                         Button("Upload", type="submit", cls="btn btn-primary mt-4"),  # Bootstrap button
                         enctype="multipart/form-data",
@@ -58,85 +74,303 @@ def home():
         cls="container mx-auto flex flex-col items-center justify-center"  # Horizontally center everything
     )
 
-# Route for processing uploaded audio file (State 2: Processing)
-@rt('/process', methods=['POST'])
+# Route for processing uploaded audio file (State 2: Processing).
+# FastHTML routes read the whole form before the handler runs, so this is a plain Starlette route
+# (added below) that gets the request body unread and streams the upload to disk as it arrives
 async def process(request):
-    form = await request.form()
+    started = time.perf_counter()
+    try:
+        form, upload = await receive_upload(request, "audio_file")
+    except UploadRejected as e:
+        return error_panel(str(e), e.status_code)
 
     # Check if the audio_file is present
-    if 'audio_file' not in form:
-        return Div(P("No audio file uploaded.", cls="text-red-500"))
+    if upload is None:
+        return HTMLResponse(to_xml(Div(P("No audio file uploaded.", cls="text-red-500"))))
 
-    audio_file = form['audio_file']
-    audio_path = save_temp_file(audio_file)
-    start_note = int(form.get('start_note', 60))  # Get start_note from form, default to 60
+    # Checked before anything is queued, so a bad note never costs a transcription
+    start_note = parse_start_note(form.get('start_note', 60))
+    if start_note is None:
+        rmtree(Path(upload.path).parent, ignore_errors=True)
+        return error_panel("Start note must be a number from 0 to 127", 400)
+    export = bool(form.get('export_slices'))
+
+    # The conversion runs as a background job; the page follows its progress until it finishes
+    try:
+        job = JOBS.submit(convert, upload.path, upload.sha256, start_note, export)
+    except QueueFull:
+        rmtree(Path(upload.path).parent, ignore_errors=True)
+        return error_panel("The server is busy, please try again in a few minutes.", 503)
+    # The upload is deleted along with the rest of the job's scratch once it has finished
+    job.scratch.track(Path(upload.path).parent)
+    job.finish_stage("upload", time.perf_counter() - started, bytes=upload.size)
 
     # Display the processing state (State 2)
+    return HTMLResponse(to_xml(processing_panel(job)))
+
+app.router.routes.append(Route('/process', process, methods=['POST']))
+
+# Route the processing panel fetches once its job is done (State 3)
+@rt('/jobs/{job_id}')
+def job_status(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return Div(P("Job not found", cls="text-danger"))
+    if job.status == FAILED:
+        return Div(P(f"Conversion failed: {job.error}", cls="text-danger"), cls="state-3 text-center")
+    if job.status == DONE:
+        return completion_panel(*job.result)
+    return processing_panel(job)
+
+# Server-sent events with the progress of a job, as published by its pipeline (see jobs.Job)
+@rt('/jobs/{job_id}/events')
+async def job_events(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return Response("Job not found", status_code=404)
+
+    async def stream():
+        async for event in job.follow():
+            # An open stream shows someone is still waiting for the job
+            job.seen()
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: progress\ndata: {json.dumps(event)}\n\n"
+        yield "event: finished\ndata: {}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def error_panel(message, status_code):
+    return HTMLResponse(to_xml(Div(P(message, cls="text-danger"), cls="text-center")), status_code=status_code)
+
+# The stages of the pipeline, in order, as they are named in progress events and shown to the user
+STAGES = [
+    ("upload", "Upload"),
+    ("transcribe", "Transcribe"),
+    ("slice", "Slice"),
+    ("build", "Build bank"),
+    ("midi", "MIDI demos"),
+    ("store", "Store"),
+]
+
+def processing_panel(job):
+    position = JOBS.position(job)
+    panel_id = f"job-{job.id}"
     return Div(
         Div(
-            Div(cls="progress-bar progress-bar-striped progress-bar-animated", role="progressbar", style="width: 100%;"),
+            Div(cls="progress-bar", role="progressbar", style="width: 0%;"),
             cls="progress"
         ),
-        P("Processing...", cls="text-center mt-4"),
-        hx_trigger="load",  # Auto-trigger to start processing
-        hx_post="/convert",  # Continue to the actual conversion step
-        hx_target="#state-panel",  # Swap content again to show completion after processing
-        hx_swap="innerHTML",  # Swap inner content with state-3
-        hx_vals={"audio_path": audio_path, "start_note": start_note},  # Pass both values
+        P(f"Waiting for {position} other upload{'s' if position != 1 else ''}..." if position else "Processing...",
+          cls="job-state text-center mt-4"),
+        Ul(*[Li(label, " ", Span(cls="stage-time text-muted"), data_stage=name, cls="list-unstyled") for name, label in STAGES],
+           cls="text-left d-inline-block"),
+        # Follow the job's progress events; once it is finished, fetch the completed state in place of this panel
+        Script(f"""
+(() => {{
+    const panel = document.getElementById("{panel_id}");
+    const stageCount = {len(STAGES)};
+    const source = new EventSource("/jobs/{job.id}/events");
+    source.addEventListener("progress", (message) => {{
+        const event = JSON.parse(message.data);
+        if (event.state === "running") panel.querySelector(".job-state").textContent = "Processing...";
+        const item = event.stage && panel.querySelector(`[data-stage="${{event.stage}}"]`);
+        if (!item) return;
+        const time = item.querySelector(".stage-time");
+        if (event.state === "done") {{
+            time.textContent = `${{event.seconds.toFixed(2)}}s`;
+            item.classList.add("text-success");
+        }} else if (event.words !== undefined) {{
+            time.textContent = `${{event.words}} words`;
+        }} else {{
+            item.classList.add("font-weight-bold");
+        }}
+        const done = panel.querySelectorAll("[data-stage].text-success").length;
+        panel.querySelector(".progress-bar").style.width = `${{100 * done / stageCount}}%`;
+    }});
+    source.addEventListener("finished", () => {{
+        source.close();
+        htmx.ajax("GET", "/jobs/{job.id}", {{target: panel, swap: "outerHTML"}});
+    }});
+}})();
+"""),
+        id=panel_id,
         cls="state-2 text-center"
     )
 
-# Route for conversion and final display (State 3: Completed)
-@rt('/convert', methods=['POST'])
-async def convert(request):
-    form = await request.form()
+async def convert(job, audio_path, audio_hash, start_note, export):
+    # Transcribe, slice and build the zones. Blocking work all happens on threads so the event
+    # loop stays free for other requests
+    temp_dir = job.scratch.mkdtemp()
+    sf = create_slicer_soundfont(temp_dir.name)
+    slices = await add_transcribed_slices(job, sf, audio_path, audio_hash, start_note)
+
+    with job.stage("build"):
+        print(f"Writing SoundFont to '{temp_dir}'")
+        # The .sf2.json equivalent is only needed when debugging the writer
+        sf2_path = await asyncio.to_thread(write_sf2_file, sf, temp_dir, bool(os.getenv("SLICER_DEBUG_SF2_JSON")))
+
+    with job.stage("midi"):
+        # create a set of wild and wonderful midi demos using the samples
+        await asyncio.to_thread(create_demo_midi_files, sf, start_note, sf2_path)
 
-    # Get the file path passed from the /process route
-    audio_path = form['audio_path']
-    start_note = int(form.get('start_note', 60))
+    with job.stage("store"):
+        stored_file_path, stored_slices_path = await asyncio.to_thread(store_soundfont, sf, slices, temp_dir, sf2_path, export)
 
-    # Transcribe and process audio
-    words = transcribe_audio(audio_path)
-    words_with_paths = slice_audio_by_words(audio_path, words)
+    return sf2_path, stored_file_path, start_note, stored_slices_path
 
-    # Create the SoundFont .sf2 file
-    temp_dir = Path(words_with_paths[0]['file_path']).parent
+async def add_transcribed_slices(job, sf, audio_path, audio_hash, start_note):
+    # Words stream in from transcription in order, so each is sliced from the upload as it is
+    # decoded and becomes a zone while later words are still being transcribed. The slices stay in
+    # memory and go straight into the SoundFont, without per-word WAV files
+    keys = sf.lay_out_keys(None, start_note)
+    slices = []
+    # The two overlap, so transcription is timed as the time spent waiting for words, and
+    # slicing as the rest
+    transcribing = 0.0
+    started = time.perf_counter()
+    job.publish(stage="transcribe", state="started")
+    job.publish(stage="slice", state="started")
+    # The hash taken while uploading saves reading the file again for the transcript cache
+    words = stream_transcription(audio_path, audio_hash=audio_hash)
 
-    print(f"Creating SoundFont from wav files in '{temp_dir}'")
-    sf, sf2_json_path = create_sf2_json_file(temp_dir,  start_note)
-    sf2_path = temp_dir / f"{sf2_json_path.stem}.sf2"
-    create_sf2_from_json(sf2_json_path, sf2_path)
+    async def timed_words():
+        nonlocal transcribing
+        try:
+            while True:
+                waiting = time.perf_counter()
+                try:
+                    word_info = await anext(words)
+                except StopAsyncIteration:
+                    return
+                finally:
+                    transcribing += time.perf_counter() - waiting
+                yield word_info
+        finally:
+            await words.aclose()
 
-    # create a set of wild and wonderful midi demos using the samples
-    create_demo_midi_files(sf, start_note, sf2_path)
+    async for word_info in slice_word_stream(audio_path, timed_words()):
+        instrument, key = next(keys)
+        instrument.add_zone(create_slice_zone(word_info, key))
+        slices.append(word_info)
+        if len(slices) % 10 == 0:
+            job.publish(stage="transcribe", state="progress", words=len(slices))
+    print(f"Added {len(slices)} slices across {len(sf.presets)} presets")
 
+    job.finish_stage("transcribe", transcribing, words=len(slices))
+    job.finish_stage("slice", time.perf_counter() - started - transcribing, presets=len(sf.presets))
+    return slices
+
+# Processes that write the word slices when they are asked for, SLICER_EXPORT_WORKERS to change
+EXPORT_WORKERS = int(os.getenv("SLICER_EXPORT_WORKERS", os.cpu_count() or 1))
+
+def store_soundfont(sf, slices, temp_dir, sf2_path, export):
     # Store the .sf2 file using the staticfiles module
     stored_file_path = store_static_file(sf2_path)
 
-    # Display the final state (State 3: Completion with download)
+    # Write and zip up the word slices only if they were asked for
+    stored_slices_path = None
+    if export:
+        slices_dir = temp_dir / "slices"
+        slices_dir.mkdir()
+        export_slices(slices, slices_dir, EXPORT_WORKERS)
+        stored_slices_path = store_static_file(Path(make_archive(str(temp_dir / f"{sf.info.name}-slices"), "zip", slices_dir)))
+
+    return stored_file_path, stored_slices_path
+
+# Route for remapping an already built SoundFont to a different start note (back to State 3)
+@rt('/remap', methods=['POST'])
+async def remap(request):
+    form = await request.form()
+
+    sf2_path = Path(form.get('sf2_path', '')).resolve()
+    start_note = parse_start_note(form.get('start_note', 60))
+    if start_note is None:
+        return error_panel("Start note must be a number from 0 to 127", 400)
+
+    # Only SoundFonts we stored ourselves can be remapped
+    if OUTPUT_DIR.resolve() not in sf2_path.parents or not sf2_path.is_file():
+        return error_panel("File not found", 404)
+
+    try:
+        remapped_path, stored_file_path = await asyncio.to_thread(remap_soundfont, sf2_path, start_note)
+    except ValueError as e:
+        # Anything else stored under output/, like a slices zip, is no SoundFont
+        return error_panel(f"Can't remap {sf2_path.name}: {e}", 400)
+    return completion_panel(remapped_path, stored_file_path, start_note)
+
+def parse_start_note(value):
+    # The start note from a form, or None if it isn't a MIDI note number
+    try:
+        start_note = int(value)
+    except (TypeError, ValueError):
+        return None
+    return start_note if 0 <= start_note <= 127 else None
+
+def remap_soundfont(sf2_path, start_note):
+    # Only the pdta tables are rebuilt; the sample data is copied over from the stored file as is.
+    # Once the result is stored the working copy is no longer needed
+    scratch = Scratch()
+    try:
+        temp_dir = scratch.mkdtemp()
+        sf, remapped_path = rebuild_sf2(sf2_path, temp_dir / sf2_path.name, start_note)
+        create_demo_midi_files(sf, start_note, remapped_path)
+        return remapped_path, store_static_file(remapped_path)
+    finally:
+        scratch.cleanup()
+
+def completion_panel(sf2_path, stored_file_path, start_note, stored_slices_path=None):
     return Div(
-        P(f"Conversion complete. File is in {sf2_path.resolve()}", cls="text-center text-lg mt-4"),
+        P(f"Conversion complete. File is in {stored_file_path}", cls="text-center text-lg mt-4"),
         A("Download", href=f"/{stored_file_path}", download=sf2_path.name, cls="btn btn-success mt-4"),  # Dynamic download URL
+        A("Download slices", href=f"/{stored_slices_path}", download=Path(stored_slices_path).name,
+          cls="btn btn-outline-success mt-4 ml-2") if stored_slices_path else "",
+        # Remapping reuses the stored SoundFont instead of transcribing and slicing again
+        Form(
+            Label("Remap to start note (0-127):", for_="remap_start_note", cls="block mb-2"),
+            Input(
+                type="number",
+                id="remap_start_note",
+                name="start_note",
+                min="0",
+                max="127",
+                value=str(start_note),
+                cls="w-20 text-center mb-4"
+            ),
+            Button("Remap", type="submit", cls="btn btn-secondary mt-4"),
+            hx_post="/remap",
+            hx_target="#state-panel",
+            hx_swap="innerHTML",
+            hx_vals={"sf2_path": str(stored_file_path)},
+            cls="flex flex-col items-center mt-4"
+        ),
         cls="state-3 text-center"
     )
 
-# Route to serve static files from the output folder
+# Route to serve static files from the output folder. Files get a strong ETag from their content
+# hash, so a browser that has one already gets a 304; Range requests are answered by FileResponse.
 @rt('/output/{file_path:path}')
-def output_file(file_path: str):
-    full_path = Path(f"output/{file_path}")
-    
-    if full_path.exists() and full_path.is_file():
-        return FileResponse(full_path)
+async def output_file(file_path: str, request: Request):
+    output_dir = OUTPUT_DIR.resolve()
+    full_path = (output_dir / file_path).resolve()
+
+    if not full_path.is_relative_to(output_dir) or not full_path.is_file():
+        return HTMLResponse(to_xml(Div(P("File not found", cls="text-danger"))), status_code=404)
+
+    etag = await asyncio.to_thread(content_etag, full_path)
+    headers = {"ETag": etag}
+    if is_immutable(file_path):
+        headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        # Downloads keep a stored file from being evicted
+        await asyncio.to_thread(touch_static_file, full_path)
     else:
-        return Div(P("File not found", cls="text-danger"))
-
-# Helper function to save uploaded file in a temporary directory
-def save_temp_file(file):
-    temp_dir = tempfile.mkdtemp()
-    file_path = os.path.join(temp_dir, file.filename)
-    with open(file_path, 'wb') as f:
-        f.write(file.file.read())
-    return file_path
+        headers["Cache-Control"] = "no-cache"  # may change, so always revalidate
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(full_path, headers=headers)
 
 # Start the FastHTML app
 serve()
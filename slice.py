@@ -1,14 +1,308 @@
 import os
+import asyncio
+import subprocess
 import tempfile
+import multiprocessing
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
 from pydub import AudioSegment
+from audioformat import TARGET_CHANNELS, TARGET_SAMPLE_RATE, TARGET_SAMPLE_WIDTH, write_wav
 
-def slice_audio_by_words(audio_path, words):
+def decode_audio(audio_path, target_rate: int = TARGET_SAMPLE_RATE):
+    """
+    Decodes the audio file once into a contiguous 16-bit mono NumPy buffer at target_rate.
+    WAV files already in that format are read as they are. Anything else is downmixed and
+    resampled by ffmpeg as it decodes (see stream_pcm_blocks), so however long or high quality
+    the upload, nothing bigger than the converted buffer is ever held in memory.
+
+    :return: The int16 PCM buffer and its sample rate.
+    """
+    try:
+        with wave.open(str(audio_path), 'rb') as wav_file:
+            if (wav_file.getframerate(), wav_file.getsampwidth(), wav_file.getnchannels()) == \
+                    (target_rate, TARGET_SAMPLE_WIDTH, TARGET_CHANNELS):
+                return np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2'), target_rate
+    except (wave.Error, EOFError):
+        pass  # not a WAV file the wave module can read, so one for ffmpeg
+    blocks = list(stream_pcm_blocks(audio_path, target_rate=target_rate))
+    return np.concatenate([*blocks, np.zeros(0, dtype='<i2')]), target_rate
+
+# Frames decoded per block when streaming; ~1.5s at 44.1kHz
+STREAM_BLOCK_FRAMES = 1 << 16
+
+def stream_pcm_blocks(audio_path, block_frames: int = STREAM_BLOCK_FRAMES, target_rate: int = TARGET_SAMPLE_RATE):
+    """
+    Decodes the audio file through an ffmpeg pipe, yielding it as 16-bit mono NumPy blocks of
+    block_frames at target_rate, so only one block is ever held in memory at a time.
+    """
+    command = [
+        AudioSegment.converter, "-nostdin", "-v", "error",
+        "-i", str(audio_path),
+        "-f", "s16le", "-acodec", "pcm_s16le", "-ac", str(TARGET_CHANNELS), "-ar", str(target_rate),
+        "-"
+    ]
+    with subprocess.Popen(command, stdout=subprocess.PIPE) as process:
+        while True:
+            block = process.stdout.read(block_frames * TARGET_SAMPLE_WIDTH)
+            if not block:
+                break
+            yield np.frombuffer(block, dtype='<i2', count=len(block) // TARGET_SAMPLE_WIDTH)
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {audio_path} (exit code {process.returncode})")
+
+def slice_pcm_blocks(blocks, words, sample_rate: int, output_dir=None):
+    """
+    Cuts every word out of a stream of 16-bit mono PCM blocks and saves it as a WAV file in
+    output_dir, adding its 'file_path' to the word info. Without an output_dir nothing is written:
+    each word info gets its 'name', 'pcm' and 'sample_rate' instead, ready for soundfonts.
+
+    Each word is written as soon as the stream has passed its end, and audio before the start of
+    the earliest word still to come is dropped, so with words sorted by start only the current
+    block plus the longest word is ever buffered. Words are numbered in list order either way.
+    """
+    def frame(seconds):
+        return seconds_to_frame(seconds, sample_rate)
+
+    upcoming = sorted(range(len(words)), key=lambda i: words[i]['start'])
+    next_word = 0  # index into upcoming of the first word the stream hasn't reached yet
+    active = []    # words the stream has reached but not yet passed the end of
+    buffer = np.zeros(0, dtype='<i2')
+    buffer_start = 0  # frame number of buffer[0] in the whole recording
+
+    # Slices of a single whole-recording block can stay views of it; slices of a stream are
+    # copied, so they don't keep every block they were cut from alive
+    keep_views = isinstance(blocks, (list, tuple)) and len(blocks) == 1
+
+    def write_word(i, buffer_end):
+        word_info = words[i]
+        start_frame, end_frame = word_frame_range(word_info, sample_rate, buffer_end)
+        pcm = buffer[start_frame - buffer_start:end_frame - buffer_start]
+        file_name = safe_filename(i + 1, word_info['word'])
+        if output_dir is None:
+            word_info['name'] = os.path.splitext(file_name)[0]
+            word_info['pcm'] = pcm if keep_views else pcm.copy()
+            word_info['sample_rate'] = sample_rate
+            return
+        word_file_path = os.path.join(output_dir, file_name)
+        write_wav(word_file_path, pcm, sample_rate)
+        word_info['file_path'] = word_file_path
+
+    for block in blocks:
+        # A single block (the whole recording when not streaming) is used without copying
+        buffer = np.concatenate((buffer, block)) if len(buffer) else block
+        buffer_end = buffer_start + len(buffer)
+
+        while next_word < len(upcoming) and frame(words[upcoming[next_word]]['start']) <= buffer_end:
+            active.append(upcoming[next_word])
+            next_word += 1
+        still_active = []
+        for i in active:
+            if frame(words[i]['end']) <= buffer_end:
+                write_word(i, buffer_end)
+            else:
+                still_active.append(i)
+        active = still_active
+
+        # Nothing before the earliest start still to be written will be needed again
+        starts = [frame(words[i]['start']) for i in active]
+        if next_word < len(upcoming):
+            starts.append(frame(words[upcoming[next_word]]['start']))
+        keep_from = min(min(starts, default=buffer_end), buffer_end)
+        if keep_from > buffer_start:
+            buffer = buffer[keep_from - buffer_start:]
+            buffer_start = keep_from
+
+    # Words running past the end of the recording get whatever audio there is
+    for i in active + upcoming[next_word:]:
+        write_word(i, buffer_start + len(buffer))
+    return words
+
+async def slice_word_stream(audio_path, words, block_frames: int = STREAM_BLOCK_FRAMES, target_rate: int = TARGET_SAMPLE_RATE):
+    """
+    Slices words out of the audio file as they arrive from an async iterator (such as
+    transcribe.stream_transcription), yielding each word info with its in-memory 'name', 'pcm'
+    and 'sample_rate' (as slice_audio_by_words does with write_files off) as soon as it is cut.
+
+    The audio is decoded through ffmpeg block by block, only as far as the latest word, and audio
+    before that word is dropped as it is read, so slicing keeps up with transcription in memory
+    bounded by a block plus the longest word. Words should therefore arrive in order of start time,
+    as they do from a transcription. One that starts before the word ahead of it is cut from where
+    that word starts, or skipped if its audio has gone altogether, rather than failing the job.
+    """
+    blocks = stream_pcm_blocks(audio_path, block_frames, target_rate)
+    buffer = np.zeros(0, dtype='<i2')
+    buffer_start = 0  # frame number of buffer[0] in the whole recording
+    exhausted = False
+    pending = None  # the block being decoded, if any
+    index = 0
+
+    def drop_before(frame):
+        # Nothing before frame will be needed again, by this word or any later one
+        nonlocal buffer, buffer_start
+        dropped = min(max(frame - buffer_start, 0), len(buffer))
+        buffer = buffer[dropped:]
+        buffer_start += dropped
+
+    try:
+        async for word_info in words:
+            start_frame = seconds_to_frame(word_info['start'], target_rate)
+            end_frame = seconds_to_frame(word_info['end'], target_rate)
+            if start_frame < buffer_start:
+                if end_frame <= buffer_start:
+                    print(f"Skipping '{word_info['word']}' at {word_info['start']}s, which arrived after later words")
+                    continue
+                start_frame = buffer_start
+            drop_before(start_frame)
+
+            # Decoding runs on a thread so the transcription keeps going meanwhile
+            while not exhausted and buffer_start + len(buffer) < end_frame:
+                pending = asyncio.ensure_future(asyncio.to_thread(next, blocks, None))
+                block = await asyncio.shield(pending)
+                if block is None:
+                    exhausted = True
+                else:
+                    buffer = np.concatenate((buffer, block)) if len(buffer) else block
+                    drop_before(start_frame)
+
+            # Words running past the end of the recording get whatever audio there is
+            start_frame = min(start_frame, buffer_start + len(buffer))
+            end_frame = min(max(end_frame, start_frame), buffer_start + len(buffer))
+            index += 1
+            word_info['name'] = os.path.splitext(safe_filename(index, word_info['word']))[0]
+            word_info['pcm'] = buffer[start_frame - buffer_start:end_frame - buffer_start].copy()
+            word_info['sample_rate'] = target_rate
+            yield word_info
+    finally:
+        # Stops ffmpeg if the words ended before the audio did (or we were cancelled), once any
+        # block already being read is in
+        if pending is not None and not pending.done():
+            await asyncio.wait({pending})
+        blocks.close()
+
+def seconds_to_frame(seconds, sample_rate: int) -> int:
+    return max(round(seconds * sample_rate), 0)
+
+def word_frame_range(word_info, sample_rate: int, total_frames: int):
+    # Frames of the word, clamped to the total_frames of audio available
+    start_frame = min(seconds_to_frame(word_info['start'], sample_rate), total_frames)
+    end_frame = min(max(seconds_to_frame(word_info['end'], sample_rate), start_frame), total_frames)
+    return start_frame, end_frame
+
+def export_pcm_slices_parallel(pcm: np.ndarray, words, sample_rate: int, output_dir, workers: int = None):
+    """
+    Saves every word as a WAV file in output_dir like slice_pcm_blocks does for a single buffer, but
+    spread over a pool of worker processes (see write_slices_parallel).
+
+    Words are numbered by their position in the list, so file names and order do not depend on
+    which worker wrote what.
+
+    :param workers: Number of worker processes; defaults to the number of CPUs.
+    """
+    slices = []
+    for i, word_info in enumerate(words):
+        start_frame, end_frame = word_frame_range(word_info, sample_rate, len(pcm))
+        word_info['file_path'] = os.path.join(output_dir, safe_filename(i + 1, word_info['word']))
+        slices.append((word_info['file_path'], start_frame, end_frame))
+    write_slices_parallel([pcm], slices, sample_rate, workers)
+    return words
+
+def write_slices_parallel(buffers, slices, sample_rate: int, workers: int = None):
+    """
+    Writes every (file_path, start_frame, end_frame) slice as a WAV file from a pool of worker
+    processes. The buffers of int16 PCM, laid end to end, are placed in shared memory once, and
+    every worker maps them rather than being sent its own copy.
+
+    The slices are split into contiguous runs, a few per worker so that the runs stay balanced.
+    """
+    workers = workers or os.cpu_count() or 1
+    run_length = max(-(-len(slices) // (workers * 4)), 1)
+    runs = [slices[i:i + run_length] for i in range(0, len(slices), run_length)]
+    frame_count = sum(len(buffer) for buffer in buffers)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(frame_count * TARGET_SAMPLE_WIDTH, 1))
+    try:
+        shared = np.ndarray((frame_count,), dtype='<i2', buffer=shm.buf)
+        offset = 0
+        for buffer in buffers:
+            shared[offset:offset + len(buffer)] = buffer
+            offset += len(buffer)
+        del shared
+        # Not forked: the web server calls this from a thread, and forking a threaded process can deadlock
+        context = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(runs) or 1), mp_context=context) as pool:
+            # list() re-raises the first error from any worker
+            list(pool.map(write_shared_slices, [(shm.name, frame_count, sample_rate, run) for run in runs]))
+    finally:
+        shm.close()
+        shm.unlink()
+
+def write_shared_slices(task):
+    # Runs in a worker process: maps the shared PCM and writes one run of words from it
+    shm_name, frame_count, sample_rate, run = task
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        pcm = np.ndarray((frame_count,), dtype='<i2', buffer=shm.buf)
+        for file_path, start_frame, end_frame in run:
+            write_wav(file_path, pcm[start_frame:end_frame], sample_rate)
+        del pcm  # the mapping can't be closed while a view of it is alive
+    finally:
+        shm.close()
+
+def safe_filename(index: int, word: str) -> str:
+    # Make word filenames safe
+    safe_word = ''.join(c for c in word if c.isalnum() or c in (' ', '_')).replace(' ', '_')
+
+    # Create filename with zero-padded index prefix (4 digits)
+    return f"{index:04d}_{safe_word}.wav"
+
+# Fewer slices than this are written in-process: starting the pool would cost more than it saves
+PARALLEL_EXPORT_MIN_SLICES = 500
+
+def export_slices(words, output_dir, workers: int = 1):
+    """
+    Writes in-memory slices (see slice_audio_by_words with write_files off) to output_dir as
+    '0001_word.wav' files, adding the 'file_path' of each to its word info.
+
+    :param workers: Write the files from this many processes at once (see write_slices_parallel),
+                    if there are at least PARALLEL_EXPORT_MIN_SLICES of them.
+    """
+    for word_info in words:
+        word_info['file_path'] = os.path.join(output_dir, word_info['name'] + ".wav")
+
+    sample_rates = {word_info['sample_rate'] for word_info in words}
+    if workers > 1 and len(words) >= PARALLEL_EXPORT_MIN_SLICES and len(sample_rates) == 1:
+        slices, offset = [], 0
+        for word_info in words:
+            slices.append((word_info['file_path'], offset, offset + len(word_info['pcm'])))
+            offset += len(word_info['pcm'])
+        write_slices_parallel([word_info['pcm'] for word_info in words], slices, sample_rates.pop(), workers)
+        return words
+
+    for word_info in words:
+        write_wav(word_info['file_path'], word_info['pcm'], word_info['sample_rate'])
+    return words
+
+def slice_audio_by_words(audio_path, words, stream: bool = False, write_files: bool = True, workers: int = 1):
     """
     Slices the given audio file into segments based on word timings and saves each segment as a WAV file.
     Files are saved with numeric prefixes (e.g., '0001_word.wav') to maintain sequence order.
 
+    The audio is decoded once into a 16-bit mono buffer (see decode_audio) and every word is written
+    from a sample-accurate view of it, so slicing costs little more than the disk writes.
+
+    With stream set the audio is instead decoded through ffmpeg block by block and each word written
+    as soon as the decoder has passed it, so memory stays bounded by the block size plus the longest
+    word however long the recording is. Words should then be sorted by start time.
+
     :param audio_path: Path to the original audio file.
     :param words: A list of dictionaries, each containing 'word', 'start', and 'end' keys.
+    :param stream: Decode and slice the audio in fixed-size blocks rather than all at once.
+    :param write_files: Save each word as a WAV file. When off the slices are only kept in memory,
+                        as 'name', 'pcm' and 'sample_rate' in each word info, and nothing touches disk.
+    :param workers: Write the WAV files from this many processes at once (see export_pcm_slices_parallel).
+                    Only used when the whole recording is decoded up front, not when streaming.
     :return: A list of dictionaries, each containing the word, its start and end times, and the file path of the saved audio segment.
 
     The function processes each word in the list, extracts the corresponding audio segment, and saves it as a WAV file.
@@ -30,32 +324,11 @@ def slice_audio_by_words(audio_path, words):
         }
     ]
     """
-    audio = AudioSegment.from_file(audio_path)
-    temp_dir = tempfile.mkdtemp()
+    temp_dir = tempfile.mkdtemp() if write_files else None
+    if stream:
+        return slice_pcm_blocks(stream_pcm_blocks(audio_path), words, TARGET_SAMPLE_RATE, temp_dir)
 
-    for i, word_info in enumerate(words, 1):
-        word = word_info['word']
-        start_time = word_info['start']  # in seconds
-        end_time = word_info['end']      # in seconds
-
-        # Calculate start and end in milliseconds
-        start_ms = int(start_time * 1000)
-        end_ms = int(end_time * 1000)
-
-        # Extract the word's audio segment
-        word_audio = audio[start_ms:end_ms]
-
-        # Make word filenames safe
-        safe_word = ''.join(c for c in word if c.isalnum() or c in (' ', '_')).replace(' ', '_')
-        
-        # Create filename with zero-padded index prefix (4 digits)
-        filename = f"{i:04d}_{safe_word}.wav"
-        #filename = f"{safe_word}.wav"
-        # Save the word as a WAV file
-        word_file_path = os.path.join(temp_dir, filename)
-        word_audio.export(word_file_path, format="wav")
-
-        # Add the file path to the word info
-        word_info['file_path'] = word_file_path
-
-    return words
+    pcm, sample_rate = decode_audio(audio_path)
+    if write_files and workers > 1:
+        return export_pcm_slices_parallel(pcm, words, sample_rate, temp_dir, workers)
+    return slice_pcm_blocks([pcm], words, sample_rate, temp_dir)
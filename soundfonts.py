@@ -3,15 +3,34 @@ from pathlib import Path
 import sys
 import json
 import wave
-from typing import List, Tuple
+from typing import List, Optional, Tuple, Union
 from midiutil import MIDIFile
 import os 
+import math
+import re
+import struct
+import mmap
+import tempfile
+import hashlib
+import itertools
+import numpy as np
 
 
 #Useful constants copied from http://www.synthfont.com/SFSPEC21.PDF
 MONO_SAMPLE_TYPE = 1
+INSTRUMENT_GENERATOR = 41
+KEY_RANGE_GENERATOR = 43
+SAMPLE_ID_GENERATOR = 53
+OVERRIDING_ROOT_KEY_GENERATOR = 58
+# Each sample in the smpl chunk must be followed by at least 46 zero valued sample points
+SAMPLE_PADDING_FRAMES = 46
+SAMPLE_WIDTH = 2 # 16-bit PCM
+# Block size used when streaming sample data that can't be copied in the kernel
+COPY_BLOCK_SIZE = 1024 * 1024
 
 class Generator:
+    __slots__ = ("operator", "amount")
+
     def __init__(self, operator: int, amount: int):
         self.operator = operator # TODO this should be an enum of all possible valid operators
         self.amount = amount
@@ -20,9 +39,15 @@ class Zone:
     # A zone is a high level representation of SF bags, generators and modulators. 
     # We have implemented only a specific scenario we care about for now,
     # where a bag has a sample id and a key range. 
-    def __init__(self, sample_path: Path, root_key: int, lower_key: int, upper_key: int):
-        self.sample = Sample(sample_path)
-        self.sample.original_pitch = root_key
+    __slots__ = ("sample", "root_key", "lower_key", "upper_key", "generators")
+
+    def __init__(self, sample: Union[Path, "Sample"], root_key: int, lower_key: int, upper_key: int):
+        if isinstance(sample, Sample):
+            # The sample may be shared with other zones, so its pitch is left alone
+            self.sample = sample
+        else:
+            self.sample = Sample(sample)
+            self.sample.original_pitch = root_key
         self.root_key = root_key
         self.lower_key = lower_key
         self.upper_key = upper_key
@@ -31,7 +56,19 @@ class Zone:
     def add_generator(self, generator: Generator):
         self.generators.append(generator)
 
+    def create_igen(self, sample_index: int, sample: "Sample"):
+        # keyRange must be the first generator of a zone and sampleID the last
+        entries = [{"operator": KEY_RANGE_GENERATOR, "amount": [self.lower_key, self.upper_key]}]
+        entries.extend({"operator": generator.operator, "amount": generator.amount} for generator in self.generators)
+        # A sample stored once for several zones only carries one of their root keys
+        if self.root_key != sample.original_pitch:
+            entries.append({"operator": OVERRIDING_ROOT_KEY_GENERATOR, "amount": self.root_key})
+        entries.append({"operator": SAMPLE_ID_GENERATOR, "amount": sample_index})
+        return entries
+
 class Instrument:
+    __slots__ = ("name", "zones")
+
     def __init__(self, name: str):
         self.name = name
         self.zones: List[Zone] = []
@@ -40,6 +77,8 @@ class Instrument:
         self.zones.append(zone)
 
 class Preset:
+    __slots__ = ("name", "preset", "bank", "instruments")
+
     def __init__(self, name: str, preset: int, bank: int):
         self.name = name
         self.preset = preset
@@ -74,16 +113,165 @@ class Info:
         }
 
 class SoundFont:
-    def __init__(self, name: str, author: str, product: str, copyright: str, comments: str):
+    def __init__(self, name: str, author: str, product: str, copyright: str, comments: str,
+                 deduplicate: bool = True, near_duplicates: bool = False):
         self.info = Info(name=name, author=author, product=product, copyright=copyright, comments=comments)
         self.presets: List[Preset] = []
+        # Zones whose samples have the same audio share one stored sample (see unique_samples)
+        self.deduplicate = deduplicate
+        self.near_duplicates = near_duplicates
+        # Set when the SoundFont was read from a file, so its sample pool can be reused as is
+        self.source_sdta = None
+        self.source_offsets = {}
+
+    @classmethod
+    def open(cls, sf2_path: Path) -> "SoundFont":
+        """
+        Reads an existing .sf2 file back into the model. The file is memory-mapped and every
+        Sample is a zero-copy view of its slice of the smpl chunk, so opening even a large bank
+        only costs the time it takes to parse the pdta tables.
+        """
+        sf2_path = Path(sf2_path)
+        with open(sf2_path, 'rb') as f:
+            buffer = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        chunks = index_riff_chunks(buffer)
+
+        info = chunks.get('INFO', (None, {}))[1]
+        product = decode_info_string(info['IPRD']) if 'IPRD' in info else decode_info_string(info.get('INAM', b''))
+        sf = cls(
+            name=sf2_path.stem,
+            author=decode_info_string(info.get('IENG', b'')),
+            product=product,
+            copyright=decode_info_string(info.get('ICOP', b'')),
+            comments=decode_info_string(info.get('ICMT', b''))
+        )
+
+        if 'pdta' not in chunks:
+            raise ValueError(f"{sf2_path} has no pdta chunk")
+        pdta = chunks['pdta'][1]
+        tables = {subchunk: list(record.iter_unpack(pdta[subchunk])) if subchunk in pdta else []
+                  for subchunk, (record, _) in PDTA_RECORDS.items()}
+        sdta_list, sdta = chunks.get('sdta', (None, {}))
+        smpl = sdta.get('smpl', memoryview(b''))
+
+        # Every shdr entry but the EOS terminator becomes one Sample, shared by all zones using it
+        samples = []
+        for name, start, end, _, _, sample_rate, original_pitch, *_ in tables['shdr'][:-1]:
+            sample = Sample.from_pcm(decode_name(name), smpl[start * SAMPLE_WIDTH:end * SAMPLE_WIDTH], sample_rate, original_pitch)
+            sf.source_offsets[sample] = (start, end)
+            samples.append(sample)
+        sf.source_sdta = sdta_list
+
+        def bag_generators(bags, generators, bag_index):
+            return generators[bags[bag_index][0]:bags[bag_index + 1][0]]
+
+        instruments = []
+        inst, ibag, igen = tables['inst'], tables['ibag'], tables['igen']
+        for i in range(len(inst) - 1):
+            instrument = Instrument(name=decode_name(inst[i][0]))
+            for bag_index in range(inst[i][1], inst[i + 1][1]):
+                generators = bag_generators(ibag, igen, bag_index)
+                sample_ids = [amount for operator, amount in generators if operator == SAMPLE_ID_GENERATOR]
+                if not sample_ids:
+                    continue # global zones have no counterpart in our model
+                sample = samples[sample_ids[-1]]
+                key_range = next((amount for operator, amount in generators if operator == KEY_RANGE_GENERATOR), 127 << 8)
+                root_key = next((amount for operator, amount in generators if operator == OVERRIDING_ROOT_KEY_GENERATOR), sample.original_pitch)
+                zone = Zone(sample, root_key=root_key, lower_key=key_range & 0xFF, upper_key=key_range >> 8)
+                for operator, amount in generators:
+                    if operator not in (KEY_RANGE_GENERATOR, SAMPLE_ID_GENERATOR, OVERRIDING_ROOT_KEY_GENERATOR):
+                        zone.add_generator(Generator(operator, amount))
+                instrument.add_zone(zone)
+            instruments.append(instrument)
+
+        phdr, pbag, pgen = tables['phdr'], tables['pbag'], tables['pgen']
+        for i in range(len(phdr) - 1):
+            name, preset_number, bank, bag_start = phdr[i][:4]
+            preset = Preset(name=decode_name(name), preset=preset_number, bank=bank)
+            for bag_index in range(bag_start, phdr[i + 1][3]):
+                for operator, amount in bag_generators(pbag, pgen, bag_index):
+                    if operator == INSTRUMENT_GENERATOR:
+                        preset.add_instrument(instruments[amount])
+            sf.presets.append(preset)
+        return sf
+
+    def remap_keys(self, start_note: int):
+        """
+        Lays the existing zones out again one key per zone from start_note, in their current order,
+        spreading them over as many presets as it takes (see lay_out_keys).
+        """
+        zones = list(self.zones())
+        self.presets = []
+        for (instrument, key), zone in zip(self.lay_out_keys(len(zones), start_note), zones):
+            zone.root_key = zone.lower_key = zone.upper_key = key
+            zone.sample.original_pitch = key
+            instrument.add_zone(zone)
+
+    def zones(self):
+        for preset in self.presets:
+            for instrument in preset.instruments:
+                yield from instrument.zones
+
+    def unique_samples(self):
+        """
+        Returns the samples to store, in order of first use, and for every zone the index of its
+        sample among them. Zones that share a Sample, or whose samples have identical audio, share
+        one shdr entry and one copy of the PCM. With near_duplicates, samples with the same coarse
+        fingerprint (see Sample.fingerprint) are merged too.
+        """
+        samples = []
+        sample_indices = []
+        seen = {}
+        for zone in self.zones():
+            sample = zone.sample
+            if self.near_duplicates:
+                key = sample.fingerprint()
+            elif self.deduplicate:
+                key = sample.content_hash()
+            else:
+                key = id(sample)
+            index = seen.get(key)
+            if index is None:
+                index = seen[key] = len(samples)
+                samples.append(sample)
+            sample_indices.append(index)
+        return samples, sample_indices
+
+    def lay_out_keys(self, count: Optional[int], start_note: int):
+        """
+        Creates as many presets as it takes to give count samples one key each, from start_note
+        up to 127, and yields the instrument and key for each sample in turn. Presets fill a bank
+        of 128 before moving on to the next bank, so no sample is ever dropped.
+        With count None it keeps going for as long as it is asked, for samples still to come.
+        """
+        if not 0 <= start_note <= 127:
+            raise ValueError(f"Start note must be between 0 and 127, got {start_note}")
+        keys_per_preset = 127 - start_note + 1
+        instrument = None
+        for i in itertools.count() if count is None else range(count):
+            shard, offset = divmod(i, keys_per_preset)
+            if offset == 0:
+                instrument = self.create_preset_and_instrument(shard)
+            yield instrument, start_note + offset
+
+    def create_preset_and_instrument(self, index: int) -> Instrument:
+        """
+        Adds the index-th preset, each holding a single instrument. Presets 0-127 go in bank 0,
+        the next 128 in bank 1 and so on.
+        """
+        bank, preset_number = divmod(index, 128)
+        if bank > 127:
+            raise ValueError(f"Too many presets for one SoundFont: {index + 1}")
+        name = self.info.name if index == 0 else f"{self.info.name} {index + 1}"
+        preset = Preset(name=name, preset=preset_number, bank=bank)
+        self.presets.append(preset)
+
+        instrument = Instrument(name=name)
+        preset.add_instrument(instrument)
+        return instrument
 
     def create_default_preset_and_instrument(self):
-        default_preset = Preset(name=self.info.name, preset=0, bank=0)
-        self.presets.append(default_preset)
-        
-        default_instrument = Instrument(name=self.info.name)
-        default_preset.add_instrument(default_instrument)
+        self.create_preset_and_instrument(0)
 
     def add_zone_to_default_instrument(self, zone: Zone):
         if self.presets and self.presets[0].instruments:
@@ -91,33 +279,126 @@ class SoundFont:
         else:
             raise ValueError("Default preset and instrument have not been created yet.")
 
-    def save(self, directory: Path) -> Path:
+    def save(self, directory: Path, sidecar: bool = False) -> Path:
+        """
+        Writes the JSON equivalent of the sf2 file to <name>.sf2.json in directory.
+
+        By default the sample pool is hex encoded inside a pretty printed document. With sidecar
+        set the JSON is compact and the smpl chunk is written as raw PCM to <name>.pcm next to
+        it, referenced by file name, offset and length.
+        """
+        pdta = self.create_pdta()
+        if sidecar:
+            pcm_path = directory / f"{self.info.name}.pcm"
+            with open(pcm_path, "wb", buffering=0) as f:
+                smpl_size = self.write_sample_pool(f, pdta["contents"]["shdr"]["entries"], 0)
+            sdta = {
+                "id": "LIST",
+                "form_type": "sdta",
+                "contents": {
+                    "smpl": {"file": pcm_path.name, "offset": 0, "length": smpl_size}
+                }
+            }
+        else:
+            sdta = self.create_sdta()
+
         sf2_json = {
             "id": "RIFF",
             "form_type": "sfbk",
             "contents": [
                 self.info.to_json(),
-                self.create_sdta(),
-                self.create_pdta()
+                sdta,
+                pdta
             ]
         }
         
         # make the path be relative to the directory
         sf2_json_path = directory / f"{self.info.name}.sf2.json"
         with open(sf2_json_path, "w") as f:
-            json.dump(sf2_json, f, indent=2)
+            if sidecar:
+                json.dump(sf2_json, f, separators=(",", ":"))
+            else:
+                json.dump(sf2_json, f, indent=2)
         return sf2_json_path
 
+    def write_sf2(self, sf2_path: Path) -> Path:
+        """
+        Serializes the SoundFont straight to a RIFF/sfbk file, without going through the JSON
+        equivalent written by save(). The JSON export is only useful for debugging.
+
+        All chunk sizes are worked out from the shdr table up front, so the headers can be written
+        first and each sample's PCM streamed from its WAV file into the smpl chunk. Peak memory is
+        bounded by the pdta tables, never by the size of the sample pool.
+        """
+        warnings = []
+        info_list = pack_info_list(self.info.to_json()["contents"], warnings)
+        pdta = self.create_pdta()["contents"]
+        pdta_list = pack_pdta_list(pdta)
+
+        source_sdta = self.reusable_sdta(pdta["shdr"]["entries"])
+        smpl_size = self.sample_pool_size(pdta["shdr"]["entries"])
+        sdta_size = 4 + 8 + smpl_size if source_sdta is None else len(source_sdta) - 8
+        riff_size = 4 + len(info_list) + 8 + sdta_size + len(pdta_list)
+
+        print(f"Writing SF2 file: {sf2_path}")
+        # Unbuffered so that kernel-side copies land at the right file position
+        with open(sf2_path, 'wb', buffering=0) as f:
+            f.write(b'RIFF' + struct.pack('<I', riff_size) + b'sfbk')
+            f.write(info_list)
+            if source_sdta is None:
+                f.write(b'LIST' + struct.pack('<I', sdta_size) + b'sdta' + b'smpl' + struct.pack('<I', smpl_size))
+                self.write_sample_pool(f, pdta["shdr"]["entries"], f.tell())
+            else:
+                print("Reusing the sdta chunk of the source file")
+                f.write(source_sdta)
+            f.write(pdta_list)
+            if f.tell() != 8 + riff_size:
+                raise ValueError(f"SF2 file {sf2_path} is {f.tell()} bytes, expected {8 + riff_size}")
+
+        print(f"SF2 file created successfully: {sf2_path} ({8 + riff_size} bytes)")
+        return sf2_path
+
+    def reusable_sdta(self, shdr_entries):
+        """
+        Returns the sdta chunk of the file this SoundFont was opened from if every sample would be
+        written back at the offsets it already has there, in which case it can be copied byte for byte.
+        """
+        if self.source_sdta is None:
+            return None
+        samples, _ = self.unique_samples()
+        for sample, entry in zip(samples, shdr_entries):
+            if self.source_offsets.get(sample) != (entry["start"], entry["end"]):
+                return None
+        return self.source_sdta
+
+    @staticmethod
+    def sample_pool_size(shdr_entries) -> int:
+        # The last entry is the EOS terminator, the one before it ends the sample pool
+        if len(shdr_entries) < 2:
+            return 0
+        return (shdr_entries[-2]["end"] + SAMPLE_PADDING_FRAMES) * SAMPLE_WIDTH
+
+    def write_sample_pool(self, f, shdr_entries, pool_offset: int) -> int:
+        """
+        Streams every sample's PCM, followed by its zero padding, into the unbuffered file f at
+        the positions given by the shdr entries. Returns the size of the sample pool in bytes.
+        """
+        samples, _ = self.unique_samples()
+        padding = bytes(SAMPLE_PADDING_FRAMES * SAMPLE_WIDTH)
+        for sample, entry in zip(samples, shdr_entries):
+            f.seek(pool_offset + entry["start"] * SAMPLE_WIDTH)
+            sample.write_data(f)
+            f.write(padding)
+        return self.sample_pool_size(shdr_entries)
+
     def create_sdta(self):
         return {
             "id": "LIST",
             "form_type": "sdta",
             "contents": {
                 "smpl": {
-                    "data": "".join(sample.get_hex_data() for preset in self.presets 
-                                    for instrument in preset.instruments 
-                                    for zone in instrument.zones 
-                                    for sample in [zone.sample])
+                    "data": "".join(sample.get_hex_data() + "00" * SAMPLE_WIDTH * SAMPLE_PADDING_FRAMES
+                                    for sample in self.unique_samples()[0])
                 }
             }
         }
@@ -141,22 +422,24 @@ class SoundFont:
 
     def create_phdr(self):
         entries = []
-        for i, preset in enumerate(self.presets):
+        bag_index = 0
+        for preset in self.presets:
             entries.append({
                 "name": preset.name,
                 "preset": preset.preset,
                 "bank": preset.bank,
-                "bag_index": i,
+                "bag_index": bag_index,
                 "library": 0,
                 "genre": 0,
                 "morphology": 0
             })
+            bag_index += len(preset.instruments)  # One bag per instrument
         # Add EOP terminator
         entries.append({
             "name": "EOP",
             "preset": 0,
             "bank": 0,
-            "bag_index": len(self.presets),
+            "bag_index": bag_index,
             "library": 0,
             "genre": 0,
             "morphology": 0
@@ -167,11 +450,12 @@ class SoundFont:
         entries = []
         gen_index = 0
         for preset in self.presets:
-            entries.append({
-                "generator_index": gen_index,
-                "modulator_index": 0
-            })
-            gen_index += 1  # One generator per preset
+            for _ in preset.instruments:
+                entries.append({
+                    "generator_index": gen_index,
+                    "modulator_index": 0
+                })
+                gen_index += 1  # One generator per bag: the instrument
         # Add terminator
         entries.append({
             "generator_index": gen_index,
@@ -190,11 +474,14 @@ class SoundFont:
 
     def create_pgen(self):
         entries = []
-        for i, preset in enumerate(self.presets):
-            entries.append({
-                "operator": 41,  # Instrument
-                "amount": i
-            })
+        instrument_index = 0
+        for preset in self.presets:
+            for _ in preset.instruments:
+                entries.append({
+                    "operator": INSTRUMENT_GENERATOR,
+                    "amount": instrument_index
+                })
+                instrument_index += 1
         # Add terminator
         entries.append({
             "operator": 0,
@@ -222,14 +509,12 @@ class SoundFont:
     def create_ibag(self):
         entries = []
         gen_index = 0
-        for preset in self.presets:
-            for instrument in preset.instruments:
-                for _ in instrument.zones:
-                    entries.append({
-                        "generator_index": gen_index,
-                        "modulator_index": 0
-                    })
-                    gen_index += 2  # Each zone has two generators: sample id and note range
+        for zone_generators in self.create_zone_generators():
+            entries.append({
+                "generator_index": gen_index,
+                "modulator_index": 0
+            })
+            gen_index += len(zone_generators)
         # Add terminator
         entries.append({
             "generator_index": gen_index,
@@ -246,23 +531,14 @@ class SoundFont:
             "transform": 0
         }]}
 
+    def create_zone_generators(self):
+        samples, sample_indices = self.unique_samples()
+        return [zone.create_igen(index, samples[index]) for zone, index in zip(self.zones(), sample_indices)]
+
     def create_igen(self):
         entries = []
-        sample_index = 0
-        for preset in self.presets:
-            for instrument in preset.instruments:
-                for zone in instrument.zones:
-                    # Sample ID
-                    entries.append({
-                        "operator": 53,  # Sample ID
-                        "amount": sample_index
-                    })
-                    # Note range
-                    entries.append({
-                        "operator": 43,  # Note range
-                        "amount": [zone.lower_key, zone.upper_key]
-                    })
-                    sample_index += 1
+        for zone_generators in self.create_zone_generators():
+            entries.extend(zone_generators)
         # Add igen terminator
         entries.append({
             "operator": 0,
@@ -273,18 +549,20 @@ class SoundFont:
     def create_shdr(self):
         entries = []
         start_offset = 0
-        for preset in self.presets:
-            for instrument in preset.instruments:
-                for zone in instrument.zones:
-                    sample = zone.sample
-                    end_offset = start_offset + sample.sample_length
-                    entries.append(sample.create_shdr(start_offset, end_offset))
-                    start_offset = end_offset + 1 # Update start_offset for the next sample
+        for sample in self.unique_samples()[0]:
+            end_offset = start_offset + sample.sample_length
+            entries.append(sample.create_shdr(start_offset, end_offset))
+            start_offset = end_offset + SAMPLE_PADDING_FRAMES # Update start_offset for the next sample
         # Add EOS terminator
         entries.append(Sample.create_terminator())
         return {"entries": entries}
 
 class Sample:
+    # Only the WAV header is read up front; the PCM is memory-mapped the first time pcm is asked for.
+    # The SoundFont writers read it with read_pcm or write_data instead, which keep nothing open
+    __slots__ = ("name", "sample_rate", "sample_length", "original_pitch",
+                 "wav_path", "data_offset", "data_size", "_buffer", "_content_hash", "_fingerprint")
+
     def __init__(self, wav_path: Path):
         with wave.open(str(wav_path), 'rb') as wav_file:
             # Use the entire filename as the sample name
@@ -295,10 +573,122 @@ class Sample:
             num_channels = wav_file.getnchannels()
             if num_channels == 2:
                 raise ValueError("Stereo samples are not supported yet")
-            self.data = wav_file.readframes(self.sample_length)
+            if wav_file.getsampwidth() != SAMPLE_WIDTH:
+                raise ValueError(f"Only 16-bit samples are supported, {wav_path} is {8 * wav_file.getsampwidth()}-bit")
+        self.wav_path = wav_path
+        self.data_offset = find_wav_data_offset(wav_path)
+        self.data_size = self.sample_length * SAMPLE_WIDTH
+        self._buffer = None
+        self._content_hash = None
+        self._fingerprint = None
+
+    @classmethod
+    def from_pcm(cls, name: str, pcm, sample_rate: int, original_pitch: int = 60) -> "Sample":
+        """
+        Wraps 16-bit mono PCM that is already in memory, or mapped from another file, without copying it.
+        """
+        pcm = memoryview(pcm).cast('B')
+        sample = cls.__new__(cls)
+        sample.name = name
+        sample.sample_rate = sample_rate
+        sample.sample_length = len(pcm) // SAMPLE_WIDTH
+        sample.original_pitch = original_pitch
+        sample.wav_path = None
+        sample.data_offset = 0
+        sample.data_size = sample.sample_length * SAMPLE_WIDTH
+        sample._buffer = pcm
+        sample._content_hash = None
+        sample._fingerprint = None
+        return sample
+
+    @property
+    def pcm(self) -> memoryview:
+        """
+        The sample's 16-bit PCM as a read-only, zero-copy view of the memory-mapped WAV file
+        (or of the buffer the sample was created from).
+        """
+        if self._buffer is None:
+            with open(self.wav_path, 'rb') as f:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._buffer)[self.data_offset:self.data_offset + self.data_size]
+
+    def read_pcm(self) -> bytes:
+        """
+        The sample's 16-bit PCM read from the WAV file in one go, for when all of it is needed at
+        once. Unlike pcm, this leaves no mapping (and no file descriptor) behind, so it can be used
+        on thousands of samples in a row. Samples created from PCM return their buffer as is.
+        """
+        if self.wav_path is None:
+            return self.pcm
+        with open(self.wav_path, 'rb') as f:
+            f.seek(self.data_offset)
+            data = f.read(self.data_size)
+        if len(data) != self.data_size:
+            raise ValueError(f"{self.wav_path} is shorter than expected, {self.data_size - len(data)} bytes missing")
+        return data
+
+    def close(self):
+        # Only the mapping of our own WAV file is ours to close
+        if self.wav_path is not None and self._buffer is not None:
+            try:
+                self._buffer.close()
+                self._buffer = None
+            except BufferError:
+                # Views handed out by pcm are still alive; the mapping goes when they do
+                pass
+
+    def content_hash(self):
+        """
+        Identifies the sample's audio exactly: two samples with the same hash store the same PCM.
+        Computed once, reading the WAV file's data chunk a block at a time.
+        """
+        if self._content_hash is None:
+            digest = hashlib.blake2b(digest_size=16)
+            if self.wav_path is None:
+                digest.update(self.pcm)
+            else:
+                with open(self.wav_path, 'rb') as f:
+                    f.seek(self.data_offset)
+                    remaining = self.data_size
+                    while remaining:
+                        block = f.read(min(remaining, COPY_BLOCK_SIZE))
+                        if not block:
+                            raise ValueError(f"{self.wav_path} is shorter than expected, {remaining} bytes missing")
+                        digest.update(block)
+                        remaining -= len(block)
+            self._content_hash = (self.sample_rate, digest.digest())
+        return self._content_hash
+
+    def fingerprint(self, bands: int = 16, levels: int = 8):
+        """
+        A coarse, loudness independent fingerprint for spotting near-duplicate slices: the length
+        to the nearest 10ms and the RMS envelope over a few bands, quantized to a few levels.
+        Different takes of the same short word often match; anything else rarely does.
+        Computed once for each bands and levels.
+        """
+        if self._fingerprint is not None and self._fingerprint[0] == (bands, levels):
+            return self._fingerprint[1]
+        frames = np.frombuffer(self.read_pcm(), dtype='<i2')
+        band_size = len(frames) // bands
+        if band_size == 0:
+            return self.content_hash()
+        # Summed as integers, so the envelope is exact however long the sample
+        squares = np.square(frames[:bands * band_size].astype(np.int64)).reshape(bands, band_size)
+        energies = (squares.sum(axis=1) / band_size).tolist()
+        peak = max(energies) or 1
+        envelope = tuple(round(levels * math.sqrt(energy / peak)) for energy in energies)
+        fingerprint = (self.sample_rate, round(100 * self.sample_length / self.sample_rate), envelope)
+        self._fingerprint = ((bands, levels), fingerprint)
+        return fingerprint
+
+    def write_data(self, f):
+        if self.wav_path is None:
+            f.write(self.pcm)
+        else:
+            copy_file_range(self.wav_path, self.data_offset, self.data_size, f)
 
     def get_hex_data(self):
-        return self.data.hex()
+        return self.read_pcm().hex()
     
     def create_shdr(self, start: int, end: int):
         return {
@@ -331,8 +721,89 @@ class Sample:
             "sample_type": 0
         }
 
+def find_wav_data_offset(wav_path: Path) -> int:
+    """
+    Returns the offset of the first byte of PCM in the WAV file's data chunk.
+    """
+    with open(wav_path, 'rb') as f:
+        riff, _, form_type = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or form_type != b'WAVE':
+            raise ValueError(f"{wav_path} is not a WAV file")
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No data chunk found in {wav_path}")
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'data':
+                return f.tell()
+            f.seek(size + (size & 1), os.SEEK_CUR) # chunks are word aligned
+
+def copy_file_range(src_path: Path, offset: int, length: int, dst):
+    """
+    Copies length bytes starting at offset in src_path to the current position of the unbuffered
+    file dst. Uses os.copy_file_range so the bytes never pass through Python where the platform
+    supports it, and falls back to a block-by-block copy otherwise.
+    """
+    with open(src_path, 'rb') as src:
+        remaining = length
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while remaining:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining, offset + length - remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            except OSError:
+                # e.g. EXDEV on older kernels or filesystems that don't support it
+                pass
+        src.seek(offset + length - remaining)
+        while remaining:
+            block = src.read(min(remaining, COPY_BLOCK_SIZE))
+            if not block:
+                raise ValueError(f"{src_path} is shorter than expected, {remaining} bytes missing")
+            dst.write(block)
+            remaining -= len(block)
+
+def index_riff_chunks(buffer: memoryview):
+    """
+    Indexes the LIST chunks of a RIFF/sfbk file without copying anything. Returns a dict mapping
+    each LIST form type (INFO, sdta, pdta) to a view of the whole LIST chunk and a dict of views
+    of its subchunks' data, keyed by subchunk id.
+    """
+    riff, riff_size, form_type = struct.unpack_from('<4sI4s', buffer, 0)
+    if riff != b'RIFF' or form_type != b'sfbk':
+        raise ValueError("Not a SoundFont 2 file")
+    chunks = {}
+    offset = 12
+    end = min(8 + riff_size, len(buffer))
+    while offset + CHUNK_HEADER.size <= end:
+        chunk_id, size = CHUNK_HEADER.unpack_from(buffer, offset)
+        if chunk_id == b'LIST':
+            list_type = bytes(buffer[offset + 8:offset + 12]).decode('latin-1')
+            subchunks = {}
+            sub_offset = offset + 12
+            while sub_offset + CHUNK_HEADER.size <= offset + 8 + size:
+                sub_id, sub_size = CHUNK_HEADER.unpack_from(buffer, sub_offset)
+                data_offset = sub_offset + CHUNK_HEADER.size
+                subchunks[sub_id.decode('latin-1')] = buffer[data_offset:data_offset + sub_size]
+                sub_offset = data_offset + sub_size + (sub_size & 1)
+            chunks[list_type] = (buffer[offset:offset + 8 + size], subchunks)
+        offset += 8 + size + (size & 1)
+    return chunks
+
+def decode_name(name: bytes) -> str:
+    return name.split(b'\0', 1)[0].decode('utf-8', errors='replace')
+
+def decode_info_string(data: memoryview) -> str:
+    return decode_name(bytes(data))
+
 import math
 
+def select_preset(midi: MIDIFile, track: int, channel: int, time: float, preset: Preset):
+    # Bank select (controller 0) followed by a program change
+    midi.addControllerEvent(track, channel, time, 0, preset.bank)
+    midi.addProgramChange(track, channel, time, preset.preset)
+
 def create_demo_midi_file(sf: SoundFont, start_note: int):
     midi = MIDIFile(1)  # Create a MIDIFile with 1 track
     track = 0
@@ -344,16 +815,20 @@ def create_demo_midi_file(sf: SoundFont, start_note: int):
     channel = 0
     volume = 100
 
-    samples = []
+    # Samples past note 127 live in further presets/banks, so each note needs its zone's preset too
+    notes = []
     for preset in sf.presets:
         for instrument in preset.instruments:
             for zone in instrument.zones:
-                samples.append(zone.sample)
+                notes.append((preset, zone.root_key, zone.sample))
 
     # Create original MIDI file
-    for i, sample in enumerate(samples):
-        pitch = min(start_note + i, 127)  # Ensure pitch is within MIDI range (0-127)
-        
+    current_preset = None
+    for preset, pitch, sample in notes:
+        if preset is not current_preset:
+            select_preset(midi, track, channel, time, preset)
+            current_preset = preset
+
         # Calculate duration in quarter notes
         duration_seconds = sample.sample_length / sample.sample_rate
         duration_quarter_notes = duration_seconds / (60 / tempo)
@@ -371,9 +846,12 @@ def create_demo_midi_file(sf: SoundFont, start_note: int):
     midi_quantized.addTempo(track, 0, tempo)
 
     time = 0
-    for i, sample in enumerate(samples):
-        pitch = min(start_note + i, 127)
-        
+    current_preset = None
+    for preset, pitch, sample in notes:
+        if preset is not current_preset:
+            select_preset(midi_quantized, track, channel, math.ceil(time * 2) / 2, preset)
+            current_preset = preset
+
         duration_seconds = sample.sample_length / sample.sample_rate
         duration_quarter_notes = duration_seconds / (60 / tempo)
         
@@ -402,6 +880,7 @@ if __name__ == "__main__":
     parser.add_argument("--copyright", type=str, default="2024 WordPlay")
     parser.add_argument("--comments", type=str, default="Created by WordPlay")
     parser.add_argument("--start-note", type=int, default=60, help="MIDI note number for the first sample")
+    parser.add_argument("--sidecar", action="store_true", help="Write compact JSON with the sample data in a raw .pcm file")
     args = parser.parse_args()
 
     samples_dir = Path(args.samples_dir)
@@ -409,25 +888,11 @@ if __name__ == "__main__":
         print(f"Error: {samples_dir} is not a valid directory", file=sys.stderr)
         sys.exit(1)
 
-    max_samples = 127
-    start_note = args.start_note
-    end_note = min(start_note + max_samples - 1, 127)  # Ensure end note doesn't exceed MIDI range
-
     samples = sorted(samples_dir.glob("*.wav"))
     if not samples:
         print(f"Error: No WAV files found in {samples_dir}", file=sys.stderr)
         sys.exit(1)
 
-    # we can only have as many samples as the number of notes on a keyboard
-    selected_samples = samples[:min(len(samples), end_note - start_note + 1)]
-
-    if len(samples) > len(selected_samples):
-        excluded_samples = samples[len(selected_samples):]
-        print(f"Warning: Number of samples ({len(samples)}) exceeds the maximum allowed ({len(selected_samples)}).")
-        print("The following samples were not included:")
-        for sample in excluded_samples:
-            print(f"- {sample}")
-
     print(f"Found {len(samples)} WAV files in {samples_dir}")
 
     # Use the directory name if --name is not provided
@@ -440,16 +905,13 @@ if __name__ == "__main__":
         copyright=args.copyright, 
         comments=args.comments
     )
-    sf.create_default_preset_and_instrument()
 
-    current_note = args.start_note
-    for sample_path in samples:
-        # for our specific situation we only have one note per sample
-        zone = Zone(sample_path, root_key=current_note, lower_key=current_note, upper_key=current_note)
-        sf.add_zone_to_default_instrument(zone)
-        current_note += 1
+    # for our specific situation we only have one note per sample, spread over as many presets as needed
+    for (instrument, key), sample_path in zip(sf.lay_out_keys(len(samples), args.start_note), samples):
+        zone = Zone(sample_path, root_key=key, lower_key=key, upper_key=key)
+        instrument.add_zone(zone)
 
-    sf.save(samples_dir)
+    sf.save(samples_dir, sidecar=args.sidecar)
     print(f"JSON equivlant of an sf2 file saved to {sf.info.name}.sf2.json")
 
     create_demo_midi_file(sf, args.start_note)
@@ -469,10 +931,197 @@ def pack_subchunk(id, data):
         data += b'\0'
     return id.encode() + struct.pack('<I', len(data)) + data
 
+INFO_SUBCHUNKS = ['ifil', 'isng', 'INAM', 'IENG', 'IPRD', 'ICOP', 'ICMT', 'ISFT']
+PDTA_SUBCHUNKS = ['phdr', 'pbag', 'pmod', 'pgen', 'inst', 'ibag', 'imod', 'igen', 'shdr']
+
+def pack_info_list(contents, warnings):
+    """
+    Packs the INFO LIST chunk from the "contents" of the JSON INFO chunk (see Info.to_json).
+    """
+    info_chunk = b''
+    for subchunk in INFO_SUBCHUNKS:
+        if subchunk in contents:
+            info = contents[subchunk]
+            if subchunk == 'ifil':
+                if isinstance(info['version'], str):
+                    major, minor = map(int, info['version'].split('.'))
+                else:
+                    major, minor = info['version']['major'], info['version']['minor']
+                data = struct.pack('<HH', major, minor)
+                print(f"  {subchunk}: Version {major}.{minor}")
+            else:
+                value = list(info.values())[0]
+                data = value.encode().ljust(len(value) + 1, b'\0')
+                if len(value) > 256:
+                    warnings.append(f"INFO.{subchunk} truncated to 256 bytes")
+                print(f"  {subchunk}: {value[:50]}... (truncated if longer than 50 chars)")
+            info_chunk += pack_subchunk(subchunk, data)
+        else:
+            print(f"  {subchunk}: Not found in JSON")
+    print(f"INFO chunk size: {len(info_chunk)} bytes")
+    return pack_chunk('LIST', b'INFO' + info_chunk)
+
+def pack_generator_amount(subchunk, operator, amount):
+    if operator == 43:  # rangesType
+        if isinstance(amount, list) and len(amount) == 2:
+            low_byte, high_byte = amount
+            return (high_byte << 8) | low_byte
+        print(f"Warning: Invalid amount format for operator 43 in {subchunk}. Using 0.")
+        return 0
+    # genAmount is a signed or unsigned 16-bit word depending on the operator
+    return amount & 0xFFFF
+
+# Record layout of every pdta subchunk (section 7 of the spec) and how to get its fields from a JSON entry.
+# Names are null padded and truncated to 20 bytes by the 20s format.
+PDTA_RECORDS = {
+    'phdr': (struct.Struct('<20sHHHIII'), lambda entry: (
+        entry['name'].encode(), entry['preset'], entry['bank'], entry['bag_index'],
+        entry['library'], entry['genre'], entry['morphology'])),
+    'pbag': (struct.Struct('<HH'), lambda entry: (entry['generator_index'], entry['modulator_index'])),
+    'pmod': (struct.Struct('<HHhHH'), lambda entry: (
+        entry['source'], entry['destination'], entry['amount'], entry['amount_source'], entry['transform'])),
+    'pgen': (struct.Struct('<HH'), lambda entry: (
+        entry['operator'], pack_generator_amount('pgen', entry['operator'], entry['amount']))),
+    'inst': (struct.Struct('<20sH'), lambda entry: (entry['name'].encode(), entry['bag_index'])),
+    'ibag': (struct.Struct('<HH'), lambda entry: (entry['generator_index'], entry['modulator_index'])),
+    'imod': (struct.Struct('<HHhHH'), lambda entry: (
+        entry['source'], entry['destination'], entry['amount'], entry['amount_source'], entry['transform'])),
+    'igen': (struct.Struct('<HH'), lambda entry: (
+        entry['operator'], pack_generator_amount('igen', entry['operator'], entry['amount']))),
+    'shdr': (struct.Struct('<20sIIIIIBbHH'), lambda entry: (
+        entry['name'].encode(), entry['start'], entry['end'], entry['loop_start'], entry['loop_end'],
+        entry['sample_rate'], entry['original_pitch'], entry['pitch_correction'], entry['sample_link'],
+        entry['sample_type'])),
+}
+CHUNK_HEADER = struct.Struct('<4sI')
+
+def pack_pdta_list(contents):
+    """
+    Packs the pdta LIST chunk from the "contents" of the JSON pdta chunk (see SoundFont.create_pdta).
+
+    The size of every subchunk is known from its entry count, so the whole chunk is packed into a
+    single preallocated buffer in one pass, in time proportional to the number of entries.
+    """
+    subchunks = []
+    for subchunk in PDTA_SUBCHUNKS:
+        if subchunk in contents:
+            entries = contents[subchunk]['entries']
+            print(f"  {subchunk}: {len(entries)} entries")
+            subchunks.append((subchunk, entries))
+        else:
+            print(f"  {subchunk}: Not found in JSON")
+
+    # Every record size is even, so subchunks never need a padding byte
+    pdta_size = 4 + sum(CHUNK_HEADER.size + len(entries) * PDTA_RECORDS[subchunk][0].size
+                        for subchunk, entries in subchunks)
+    pdta_list = bytearray(CHUNK_HEADER.size + pdta_size)
+    CHUNK_HEADER.pack_into(pdta_list, 0, b'LIST', pdta_size)
+    pdta_list[8:12] = b'pdta'
+    offset = 12
+    for subchunk, entries in subchunks:
+        record, fields = PDTA_RECORDS[subchunk]
+        CHUNK_HEADER.pack_into(pdta_list, offset, subchunk.encode(), len(entries) * record.size)
+        offset += CHUNK_HEADER.size
+        for entry in entries:
+            record.pack_into(pdta_list, offset, *fields(entry))
+            offset += record.size
+    print(f"pdta chunk size: {pdta_size - 4} bytes")
+    return pdta_list
+
+def write_riff_file(output_path, chunks):
+    riff_size = sum(len(chunk) for chunk in chunks)
+
+    # Update RIFF header with correct size and form type
+    riff_header = b'RIFF' + struct.pack('<I', riff_size + 4) + b'sfbk'
+
+    # Write the final sf2 file
+    print(f"Writing SF2 file: {output_path}")
+    with open(output_path, 'wb') as f:
+        f.write(riff_header)
+        for chunk in chunks:
+            f.write(chunk)
+
+    print(f"\nSF2 file created successfully: {output_path}")
+    print(f"Total file size: {len(riff_header) + riff_size} bytes")
+
+# Finds the start of the hex encoded sample pool in legacy .sf2.json files
+HEX_SMPL_PATTERN = re.compile(r'"smpl"\s*:\s*\{\s*"data"\s*:\s*"')
+
+def extract_hex_smpl(json_path, pcm_file, block_size: int = COPY_BLOCK_SIZE) -> str:
+    """
+    Reads a legacy .sf2.json file incrementally, decoding the hex encoded smpl data into pcm_file
+    block by block. Returns the rest of the document with the smpl data replaced by an empty
+    string, which is small enough to hand to json.loads.
+    """
+    text = []
+    with open(json_path, 'r') as f:
+        # Scan for the start of the hex string, keeping enough of each block to match across blocks
+        buffer = ''
+        while True:
+            block = f.read(block_size)
+            buffer += block
+            match = HEX_SMPL_PATTERN.search(buffer)
+            if match or not block:
+                break
+            text.append(buffer[:-256])
+            buffer = buffer[-256:]
+        if not match:
+            text.append(buffer)
+            return ''.join(text)
+
+        text.append(buffer[:match.end()])
+        hex_data = buffer[match.end():]
+        while True:
+            end = hex_data.find('"')
+            if end >= 0:
+                pcm_file.write(bytes.fromhex(hex_data[:end]))
+                text.append(hex_data[end:])
+                break
+            # Only decode whole bytes, carrying an odd trailing digit into the next block
+            whole = len(hex_data) - len(hex_data) % 2
+            pcm_file.write(bytes.fromhex(hex_data[:whole]))
+            block = f.read(block_size)
+            if not block:
+                raise ValueError(f"Unterminated smpl data in {json_path}")
+            hex_data = hex_data[whole:] + block
+        text.append(f.read())
+    return ''.join(text)
+
+def map_pcm(f, offset: int, length: int) -> memoryview:
+    if length == 0:
+        return memoryview(b'')
+    pcm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if offset + length > len(pcm):
+        raise ValueError(f"smpl data needs {offset + length} bytes but only {len(pcm)} are available")
+    return memoryview(pcm)[offset:offset + length]
+
+def load_sf2_json(json_path):
+    """
+    Loads a .sf2.json file written by SoundFont.save, returning the parsed document and the smpl
+    data as a memory-mapped view. Accepts both the compact form, where the smpl data lives in a
+    raw .pcm sidecar, and the legacy form with hex encoded data, which is decoded into a
+    temporary file without ever holding the whole document in memory.
+    """
+    json_path = Path(json_path)
+    with tempfile.TemporaryFile() as pcm_file:
+        sf2_data = json.loads(extract_hex_smpl(json_path, pcm_file))
+        smpl = None
+        for chunk in sf2_data['contents']:
+            if chunk['id'] == 'LIST' and chunk['form_type'] == 'sdta' and 'smpl' in chunk['contents']:
+                smpl = chunk['contents']['smpl']
+                break
+        if smpl is None:
+            return sf2_data, None
+        if 'file' in smpl:
+            with open(json_path.parent / smpl['file'], 'rb') as sidecar:
+                return sf2_data, map_pcm(sidecar, smpl.get('offset', 0), smpl['length'])
+        # mmap keeps its own handle, so the temporary file can be closed once mapped
+        pcm_file.flush()
+        return sf2_data, map_pcm(pcm_file, 0, pcm_file.tell())
+
 def create_sf2_from_json(json_path, output_path):
     print(f"Reading JSON file: {json_path}")
-    with open(json_path, 'r') as f:
-        sf2_data = json.load(f)
+    sf2_data, sample_data = load_sf2_json(json_path)
     
     print("JSON file loaded successfully")
     print(f"SF2 version: {sf2_data['id']} {sf2_data['form_type']}")
@@ -481,150 +1130,86 @@ def create_sf2_from_json(json_path, output_path):
 
     # Pack INFO chunk
     print("Processing INFO chunk...")
-    info_chunk = b''
+    info_list = pack_chunk('LIST', b'INFO')
     for chunk in sf2_data['contents']:
         if chunk['id'] == 'LIST' and chunk['form_type'] == 'INFO':
-            for subchunk in ['ifil', 'isng', 'INAM', 'IENG', 'IPRD', 'ICOP', 'ICMT', 'ISFT']:
-                if subchunk in chunk['contents']:
-                    info = chunk['contents'][subchunk]
-                    if subchunk == 'ifil':
-                        if isinstance(info['version'], str):
-                            major, minor = map(int, info['version'].split('.'))
-                        else:
-                            major, minor = info['version']['major'], info['version']['minor']
-                        data = struct.pack('<HH', major, minor)
-                        print(f"  {subchunk}: Version {major}.{minor}")
-                    else:
-                        value = list(info.values())[0]
-                        data = value.encode().ljust(len(value) + 1, b'\0')
-                        if len(value) > 256:
-                            warnings.append(f"INFO.{subchunk} truncated to 256 bytes")
-                        print(f"  {subchunk}: {value[:50]}... (truncated if longer than 50 chars)")
-                    info_chunk += pack_subchunk(subchunk, data)
-                else:
-                    print(f"  {subchunk}: Not found in JSON")
+            info_list = pack_info_list(chunk['contents'], warnings)
             break
-    info_list = pack_chunk('LIST', b'INFO' + info_chunk)
-    print(f"INFO chunk size: {len(info_chunk)} bytes")
 
-    # Pack sdta chunk
+    # Pack sdta chunk, leaving the sample data itself to be written straight from the mapping
     print("Processing sdta chunk...")
-    sdta_chunk = b''
-    for chunk in sf2_data['contents']:
-        if chunk['id'] == 'LIST' and chunk['form_type'] == 'sdta':
-            if 'smpl' in chunk['contents']:
-                sample_data = bytes.fromhex(chunk['contents']['smpl']['data'])
-                sdta_chunk += pack_subchunk('smpl', sample_data)
-                print(f"  smpl: {len(sample_data)} bytes of sample data")
-            else:
-                print("  smpl: No sample data found")
-            break
-    sdta_list = pack_chunk('LIST', b'sdta' + sdta_chunk)
-    print(f"sdta chunk size: {len(sdta_chunk)} bytes")
+    sdta_chunks = [b'LIST', b'sdta']
+    if sample_data is not None:
+        padding = b'\0' * (len(sample_data) % 2)
+        sdta_chunks += [b'smpl' + struct.pack('<I', len(sample_data) + len(padding)), sample_data, padding]
+        print(f"  smpl: {len(sample_data)} bytes of sample data")
+    else:
+        print("  smpl: No sample data found")
+    sdta_chunks[0] += struct.pack('<I', sum(len(chunk) for chunk in sdta_chunks[1:]))
+    print(f"sdta chunk size: {sum(len(chunk) for chunk in sdta_chunks[2:])} bytes")
 
     # Pack pdta chunk
     print("Processing pdta chunk...")
-    pdta_chunk = b''
+    pdta_list = pack_chunk('LIST', b'pdta')
     for chunk in sf2_data['contents']:
         if chunk['id'] == 'LIST' and chunk['form_type'] == 'pdta':
-            for subchunk in ['phdr', 'pbag', 'pmod', 'pgen', 'inst', 'ibag', 'imod', 'igen', 'shdr']:
-                if subchunk in chunk['contents']:
-                    entries = chunk['contents'][subchunk]['entries']
-                    packed_entries = b''
-                    print(f"  {subchunk}: {len(entries)} entries")
-                    for entry in entries:
-                        if subchunk in ['pgen', 'igen']:
-                            operator = entry['operator']
-                            amount = entry['amount']
-                            if operator == 43:  # rangesType
-                                if isinstance(amount, list) and len(amount) == 2:
-                                    low_byte, high_byte = amount
-                                    print(f"  {subchunk}: {operator} {low_byte} {high_byte}")
-                                    amount = (high_byte << 8) | low_byte
-                                else:
-                                    print(f"Warning: Invalid amount format for operator 43 in {subchunk}. Using 0.")
-                                    amount = 0
-                            packed_entries += struct.pack('<HH', operator, amount)
-                        elif subchunk == 'phdr':
-                            name = entry['name'].encode().ljust(20, b'\0')[:20]
-                            packed_entries += struct.pack('<20sHHHIII', 
-                                name, 
-                                entry['preset'], entry['bank'], entry['bag_index'],
-                                entry['library'], entry['genre'], entry['morphology'])
-                        elif subchunk == 'pbag':
-                            packed_entries += struct.pack('<HH', 
-                                entry['generator_index'], entry['modulator_index'])
-                        elif subchunk == 'pmod':
-                            packed_entries += struct.pack('<BBHBHxxx', 
-                                entry['source'], entry['destination'], entry['amount'],
-                                entry['amount_source'], entry['transform'])
-                        elif subchunk == 'inst':
-                            name = entry['name'].encode().ljust(20, b'\0')[:20]
-                            packed_entries += struct.pack('<20sH', 
-                                name, entry['bag_index'])
-                        elif subchunk == 'ibag':
-                            packed_entries += struct.pack('<HH', 
-                                entry['generator_index'], entry['modulator_index'])
-                        elif subchunk == 'imod':
-                            packed_entries += struct.pack('<HHhHH', 
-                                entry['source'], entry['destination'], entry['amount'],
-                                entry['amount_source'], entry['transform'])
-                        elif subchunk == 'igen':
-                            packed_entries += struct.pack('<HH', 
-                                entry['operator'], entry['amount'])
-                        elif subchunk == 'shdr':
-                            name = entry['name'].encode().ljust(20, b'\0')[:20]
-                            packed_entries += struct.pack('<20sIIIIIBbHH', 
-                                name, entry['start'], entry['end'],
-                                entry['loop_start'], entry['loop_end'], entry['sample_rate'],
-                                entry['original_pitch'], entry['pitch_correction'], entry['sample_link'],
-                                entry['sample_type'])
-                    pdta_chunk += pack_subchunk(subchunk, packed_entries)
-                else:
-                    print(f"  {subchunk}: Not found in JSON")
+            pdta_list = pack_pdta_list(chunk['contents'])
             break
-    pdta_list = pack_chunk('LIST', b'pdta' + pdta_chunk)
-    print(f"pdta chunk size: {len(pdta_chunk)} bytes")
 
-    # Combine all chunks
-    riff_data = info_list + sdta_list + pdta_list
+    write_riff_file(output_path, [info_list, *sdta_chunks, pdta_list])
 
-    # Update RIFF header with correct size and form type
-    riff_header = b'RIFF' + struct.pack('<I', len(riff_data) + 4) + b'sfbk'
-
-    # Write the final sf2 file
-    print(f"Writing SF2 file: {output_path}")
-    with open(output_path, 'wb') as f:
-        f.write(riff_header + riff_data)
 
-    print(f"\nSF2 file created successfully: {output_path}")
-    print(f"Total file size: {len(riff_header + riff_data)} bytes")
-
-
-def create_sf2_json_file(samples_dir: Path, start_note: int = 60) -> Tuple[SoundFont, Path]:
-    sf = SoundFont(
-        name=samples_dir.name,
+def create_slicer_soundfont(name: str) -> SoundFont:
+    return SoundFont(
+        name=name,
         author="AudioSlicer",
         product="AudioSlicer",
         copyright="2024 Slice.media",
         comments="Created by Slice.media"
     )
-    sf.create_default_preset_and_instrument()
 
-    max_samples = 127 - start_note + 1
-    samples = sorted(samples_dir.glob("*.wav"))[:max_samples]
-    # print out the samples found
 
-    selected_samples = samples[:max_samples]
-    if len(samples) > max_samples:
-        print(f"Warning: Number of samples ({len(samples)}) exceeds the maximum allowed ({max_samples}) when starting at note {start_note}")
-        print("The following samples were skipped:")
-        for sample in samples[max_samples:]:
-            print(f"- {sample}")
+def create_soundfont(samples_dir: Path, start_note: int = 60) -> SoundFont:
+    sf = create_slicer_soundfont(samples_dir.name)
 
-    for i, sample_path in enumerate(selected_samples):
-        zone = Zone(sample_path, root_key=start_note + i, lower_key=start_note + i, upper_key=start_note + i)
+    # Samples beyond note 127 go into further presets (and banks) rather than being dropped
+    samples = sorted(samples_dir.glob("*.wav"))
+    for (instrument, key), sample_path in zip(sf.lay_out_keys(len(samples), start_note), samples):
+        zone = Zone(sample_path, root_key=key, lower_key=key, upper_key=key)
         print(f"Adding zone for {sample_path}")
-        sf.add_zone_to_default_instrument(zone)
-
-    return sf, sf.save(samples_dir)
+        instrument.add_zone(zone)
+    print(f"Added {len(samples)} samples across {len(sf.presets)} presets")
+
+    return sf
+
+
+def create_slice_zone(word_info, key: int) -> Zone:
+    # A zone playing one in-memory slice (see slice.slice_audio_by_words) on one key
+    sample = Sample.from_pcm(word_info['name'], word_info['pcm'], word_info['sample_rate'], original_pitch=key)
+    return Zone(sample, root_key=key, lower_key=key, upper_key=key)
+
+
+def rebuild_sf2(sf2_path: Path, output_path: Path, start_note: int) -> Tuple[SoundFont, Path]:
+    """
+    Rebuilds an existing .sf2 file for a new start note without re-slicing anything: only the pdta
+    tables are regenerated and the sdta chunk is spliced in byte for byte from the original.
+    The output is written to a temporary file first, so output_path may be sf2_path itself.
+    """
+    sf = SoundFont.open(sf2_path)
+    sf.remap_keys(start_note)
+    output_path = Path(output_path)
+    fd, temp_path = tempfile.mkstemp(suffix=".sf2", dir=output_path.parent)
+    os.close(fd)
+    try:
+        sf.write_sf2(Path(temp_path))
+        os.replace(temp_path, output_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return sf, output_path
+
+
+def write_sf2_file(sf: SoundFont, output_dir: Path, debug_json: bool = False) -> Path:
+    if debug_json:
+        sf.save(output_dir)
+    return sf.write_sf2(output_dir / f"{sf.info.name}.sf2")
@@ -1,17 +1,31 @@
 import os
+import re
 import shutil
 import uuid
 from pathlib import Path
+from storage import evict_least_recently_used, hash_file
 
 OUTPUT_DIR = Path("output")  # Directory where files will be stored
 
 # Ensure the output directory exists
 OUTPUT_DIR.mkdir(exist_ok=True)
 
+# Stored files are kept for OUTPUT_MAX_AGE since they were last downloaded, and the least recently
+# downloaded are removed whenever output/ holds more than OUTPUT_MAX_BYTES (see evict_static_files)
+OUTPUT_MAX_BYTES = int(os.getenv("SLICER_OUTPUT_MAX_MB", 2048)) * 1024 * 1024
+OUTPUT_MAX_AGE = float(os.getenv("SLICER_OUTPUT_MAX_AGE_HOURS", 24)) * 60 * 60
+
+UUID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+# Content hashes of files we've served or stored, by (path, size, mtime), so each is only read once
+ETAG_CACHE = {}
+ETAG_CACHE_SIZE = 4096
+
 
 def store_static_file(input_path: Path) -> Path:
     """
     Store the file in a unique subfolder under output/ and return the relative path to the file.
+    The file is hashed as it is copied, so its ETag is ready before anyone asks for it.
     """
     # Create a unique folder name inside the output directory
     unique_folder = OUTPUT_DIR / str(uuid.uuid4())
@@ -19,7 +33,88 @@ def store_static_file(input_path: Path) -> Path:
 
     # Copy the input file to the unique folder
     target_file = unique_folder / input_path.name
-    shutil.copy(input_path, target_file)
+    with open(target_file, 'wb') as dst:
+        digest = hash_file(input_path, copy_to=dst)
+    # Only once the copy is closed do its size and modification time stay put
+    remember_etag(target_file, f'"{digest}"')
+    evict_static_files(keep=unique_folder)
 
     # Return the relative path: output/<unique folder>/<file name>
     return target_file.relative_to(OUTPUT_DIR.parent)
+
+
+def content_etag(path: Path) -> str:
+    """
+    Returns a strong ETag for the file: the quoted sha256 of its contents. The hash is cached for
+    as long as the file's size and modification time stay the same.
+    """
+    stat = os.stat(path)
+    etag = ETAG_CACHE.get(etag_key(path, stat))
+    if etag is None:
+        etag = f'"{hash_file(path)}"'
+        remember_etag(path, etag, stat)
+    return etag
+
+
+def remember_etag(path: Path, etag: str, stat: os.stat_result = None):
+    stat = stat or os.stat(path)
+    if len(ETAG_CACHE) >= ETAG_CACHE_SIZE:
+        # Forget the oldest entry
+        del ETAG_CACHE[next(iter(ETAG_CACHE))]
+    ETAG_CACHE[etag_key(path, stat)] = etag
+
+
+def etag_key(path: Path, stat: os.stat_result) -> tuple:
+    # Resolved, so output/<uuid>/x from store_static_file and the absolute path serve looks up agree
+    return str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns
+
+
+def is_immutable(relative_path: str) -> bool:
+    """
+    Whether the path (relative to output/) is in one of the unique folders store_static_file
+    creates. Those are never written to again, so they can be cached forever.
+    """
+    parts = Path(relative_path).parts
+    return len(parts) > 1 and bool(UUID_PATTERN.match(parts[0]))
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches the ETag, using the weak comparison RFC 9110
+    specifies for it.
+    """
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (candidate.strip() for candidate in if_none_match.split(","))
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+def touch_static_file(path: Path):
+    """
+    Marks the folder the stored file is in as just used, so it is the last to be evicted.
+    """
+    os.utime(Path(path).parent)
+
+
+def evict_static_files(max_bytes: int = OUTPUT_MAX_BYTES, max_age: float = OUTPUT_MAX_AGE, keep: Path = None):
+    """
+    Removes the folders store_static_file created that haven't been used for max_age seconds,
+    then the least recently used until output/ fits in max_bytes. A folder's modification time is
+    its last-used time. keep, the folder just stored, is never removed.
+    """
+    entries = []
+    for folder in OUTPUT_DIR.iterdir():
+        if not folder.is_dir() or not UUID_PATTERN.match(folder.name):
+            continue
+        try:
+            last_used = folder.stat().st_mtime
+            size = sum(path.stat().st_size for path in folder.rglob("*") if path.is_file())
+        except FileNotFoundError:
+            continue  # evicted by another process
+        entries.append((last_used, size, folder))
+
+    def remove(folder):
+        print(f"Removing {folder} from output/")
+        shutil.rmtree(folder, ignore_errors=True)
+
+    evict_least_recently_used(entries, max_bytes, max_age, remove, keep)
@@ -0,0 +1,42 @@
+import time
+import hashlib
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path, copy_to=None, block_size: int = HASH_BLOCK_SIZE) -> str:
+    """
+    Returns the sha256 hex digest of the file's bytes, read in blocks so large files are never
+    held in memory at once. If copy_to (a file open for writing) is given, every block is written
+    to it too, so a copy is hashed without reading the file twice.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            digest.update(block)
+            if copy_to is not None:
+                copy_to.write(block)
+    return digest.hexdigest()
+
+
+def evict_least_recently_used(entries, max_bytes: int, max_age: float, remove, keep=None):
+    """
+    Evicts from a cache or store given as (last_used, size, entry) for each of its entries: those
+    not used for max_age seconds are removed (by calling remove with the entry), then the least
+    recently used until the rest fit in max_bytes. keep is counted but never removed.
+    """
+    now = time.time()
+    remaining = []
+    for last_used, size, entry in entries:
+        if entry != keep and now - last_used > max_age:
+            remove(entry)
+        else:
+            remaining.append((last_used, size, entry))
+
+    total_size = sum(size for _, size, _ in remaining)
+    for _, size, entry in sorted(remaining, key=lambda item: item[0]):
+        if total_size <= max_bytes:
+            break
+        if entry != keep:
+            remove(entry)
+            total_size -= size
@@ -0,0 +1,69 @@
+# content of test_jobs.py
+import asyncio
+from jobs import DONE, FAILED, JobQueue
+
+def test_jobs_run_on_a_bounded_pool():
+    running, most_running = 0, 0
+
+    async def pipeline(job, value):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if value == "bad":
+            raise ValueError("bad upload")
+        return value * 2
+
+    async def main():
+        queue = JobQueue(worker_count=2)
+        await queue.start()
+        jobs = [queue.submit(pipeline, value) for value in (1, 2, "bad", 3)]
+        await queue.queue.join()
+        await queue.stop()
+        return jobs
+
+    jobs = asyncio.run(main())
+    assert [(job.status, job.result, job.error) for job in jobs] == [
+        (DONE, 2, None), (DONE, 4, None), (FAILED, None, "bad upload"), (DONE, 6, None)
+    ]
+    assert most_running == 2
+
+def test_abandoned_jobs_are_cancelled():
+    async def pipeline(job):
+        await asyncio.sleep(10)
+
+    async def main():
+        queue = JobQueue(worker_count=1, abandon_after=0.5)
+        await queue.start()
+        job = queue.submit(pipeline)
+        await asyncio.wait_for(queue.queue.join(), 5)
+        await queue.stop()
+        return job
+
+    job = asyncio.run(main())
+    assert (job.status, job.error) == (FAILED, "Cancelled")
+
+def test_progress_events_can_be_followed_as_they_happen():
+    async def pipeline(job):
+        with job.stage("transcribe"):
+            await asyncio.sleep(0.01)
+        # Stages may run on threads too
+        await asyncio.to_thread(lambda: job.finish_stage("build", 0.5, presets=1))
+
+    async def main():
+        queue = JobQueue(worker_count=1)
+        await queue.start()
+        job = queue.submit(pipeline)
+        events = [event async for event in job.follow()]
+        await queue.stop()
+        return events
+
+    events = [{key: value for key, value in event.items() if key not in ("time", "seconds")} for event in asyncio.run(main())]
+    assert events == [
+        {"state": "running"},
+        {"stage": "transcribe", "state": "started"},
+        {"stage": "transcribe", "state": "done"},
+        {"stage": "build", "state": "done", "presets": 1},
+        {"state": "done", "error": None},
+    ]
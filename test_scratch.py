@@ -0,0 +1,45 @@
+# content of test_scratch.py
+import asyncio
+import os
+import time
+from jobs import DONE, FAILED, JobQueue
+from scratch import SCRATCH_PREFIX, sweep_scratch
+
+def test_job_scratch_is_removed_when_it_finishes(tmp_path):
+    upload = tmp_path / "upload.wav"
+    upload.write_bytes(b"RIFF")
+    scratch_dirs = []
+
+    async def pipeline(job, fail):
+        temp_dir = job.scratch.mkdtemp()
+        (temp_dir / "grandad.sf2").write_bytes(b"sfbk")
+        scratch_dirs.append(temp_dir)
+        if fail:
+            raise ValueError("bad upload")
+
+    async def main():
+        queue = JobQueue(worker_count=1)
+        await queue.start()
+        jobs = [queue.submit(pipeline, fail) for fail in (False, True)]
+        jobs[0].scratch.track(upload)
+        await queue.queue.join()
+        await queue.stop()
+        return jobs
+
+    jobs = asyncio.run(main())
+    assert [job.status for job in jobs] == [DONE, FAILED]
+    assert len(scratch_dirs) == 2
+    assert not any(path.exists() for path in scratch_dirs + [upload])
+
+def test_sweep_removes_only_stale_scratch(tmp_path):
+    stale, fresh, other = tmp_path / f"{SCRATCH_PREFIX}old", tmp_path / f"{SCRATCH_PREFIX}new", tmp_path / "unrelated"
+    for path in (stale, fresh, other):
+        path.mkdir()
+    day_ago = time.time() - 24 * 60 * 60
+    os.utime(stale, (day_ago, day_ago))
+    os.utime(other, (day_ago, day_ago))
+
+    sweep_scratch(tmp_path, max_age=60 * 60)
+
+    assert not stale.exists()
+    assert fresh.exists() and other.exists()
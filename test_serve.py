@@ -0,0 +1,46 @@
+# content of test_serve.py
+import pytest
+from pathlib import Path
+from starlette.testclient import TestClient
+import staticfiles
+from serve import app
+
+# Absolute, as the client fixture runs each test in its own directory
+AUDIO_PATH = Path(__file__).parent / "tests/data/slice/thankyougrandad-3-words/input/thankyougrandad-3-words.wav"
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(staticfiles, "OUTPUT_DIR", tmp_path / "output")
+    monkeypatch.setattr("serve.OUTPUT_DIR", tmp_path / "output")
+    staticfiles.OUTPUT_DIR.mkdir()
+    return TestClient(app)
+
+def test_remap_rejects_bad_notes_and_files_that_are_not_soundfonts(client, tmp_path):
+    zip_path = tmp_path / "grandad-slices.zip"
+    zip_path.write_bytes(b"PK\x03\x04" + bytes(64))
+    stored_path = staticfiles.store_static_file(zip_path)
+
+    for start_note in ("200", "-1", "middle C"):
+        response = client.post("/remap", data={"sf2_path": str(stored_path), "start_note": start_note})
+        assert response.status_code == 400
+        assert "0 to 127" in response.text
+
+    response = client.post("/remap", data={"sf2_path": str(stored_path), "start_note": "60"})
+    assert response.status_code == 400
+    assert "Can't remap grandad-slices.zip" in response.text
+
+    response = client.post("/remap", data={"sf2_path": "output/missing.sf2", "start_note": "60"})
+    assert response.status_code == 404
+
+def test_process_rejects_bad_start_notes_before_queueing(client, monkeypatch):
+    submitted = []
+    monkeypatch.setattr("serve.JOBS.submit", lambda *args: submitted.append(args))
+    audio = AUDIO_PATH.read_bytes()
+
+    for start_note in ("200", "C4"):
+        response = client.post("/process", files={"audio_file": ("grandad.wav", audio, "audio/wav")},
+                               data={"start_note": start_note})
+        assert response.status_code == 400
+        assert "0 to 127" in response.text
+    assert submitted == []
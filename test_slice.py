@@ -1,9 +1,14 @@
 # content of test_slice.py
 import os
+import shutil
 import json
+import asyncio
+import wave
+import numpy as np
 import pytest
 from pydub import AudioSegment
-from slice import slice_audio_by_words
+import slice
+from slice import decode_audio, export_pcm_slices_parallel, export_slices, slice_audio_by_words, slice_pcm_blocks, slice_word_stream
 
 @pytest.fixture
 def audio_test_cases():
@@ -33,3 +38,116 @@ def test_slice_audio_by_words(audio_test_cases):
             assert segment['word'] == expected_segment['word'], f"Word mismatch: {segment['word']} != {expected_segment['word']}"
             assert abs(segment['start'] - expected_segment['start']) < 0.01, f"Start time mismatch for word {segment['word']}"
             assert abs(segment['end'] - expected_segment['end']) < 0.01, f"End time mismatch for word {segment['word']}"
+
+@pytest.mark.skipif(shutil.which(AudioSegment.converter) is None, reason="needs ffmpeg")
+def test_decode_audio_converts_to_16_bit_mono(tmp_path):
+    # A 48kHz 24-bit stereo upload, as a high quality recorder would produce
+    stereo_path = tmp_path / "stereo.wav"
+    frames = np.stack([np.linspace(-0.5, 0.5, 4800), np.zeros(4800)], axis=1)
+    raw = (frames * 2**23).astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    with wave.open(str(stereo_path), 'wb') as wav_file:
+        wav_file.setnchannels(2)
+        wav_file.setsampwidth(3)
+        wav_file.setframerate(48000)
+        wav_file.writeframes(raw)
+
+    pcm, sample_rate = decode_audio(stereo_path)
+
+    assert (pcm.dtype, sample_rate) == (np.dtype('<i2'), 44100)
+    assert abs(len(pcm) - 4410) <= 1
+    # The left channel ramp, halved by the downmix (away from the edges, where the resampler rings)
+    assert abs(pcm[1102] / 32767 + 0.125) < 0.01
+    assert abs(pcm[3307] / 32767 - 0.125) < 0.01
+
+def test_streamed_slices_match_whole_buffer_slices(tmp_path):
+    input_path = "tests/data/slice/thankyougrandad-3-words/input/thankyougrandad-3-words.wav"
+    with open("tests/data/slice/thankyougrandad-3-words/output/output.json", 'r') as f:
+        words = json.load(f)
+    with wave.open(input_path, 'rb') as wav_file:
+        pcm = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+
+    whole_dir, streamed_dir = tmp_path / "whole", tmp_path / "streamed"
+    whole_dir.mkdir()
+    streamed_dir.mkdir()
+    slice_pcm_blocks([pcm], [dict(word) for word in words], 44100, whole_dir)
+    blocks = (pcm[i:i + 1000] for i in range(0, len(pcm), 1000))
+    streamed = slice_pcm_blocks(blocks, [dict(word) for word in words], 44100, streamed_dir)
+
+    assert [os.path.basename(word['file_path']) for word in streamed] == ["0001_Thank.wav", "0002_you.wav", "0003_Grandad.wav"]
+    for name in os.listdir(whole_dir):
+        with open(whole_dir / name, 'rb') as whole, open(streamed_dir / name, 'rb') as streamed_file:
+            assert whole.read() == streamed_file.read()
+
+    # Without an output directory the same slices are kept in memory instead
+    in_memory = slice_pcm_blocks((pcm[i:i + 1000] for i in range(0, len(pcm), 1000)), [dict(word) for word in words], 44100)
+    assert [word['name'] for word in in_memory] == ["0001_Thank", "0002_you", "0003_Grandad"]
+    assert not any('file_path' in word for word in in_memory)
+    for word in in_memory:
+        assert (whole_dir / f"{word['name']}.wav").read_bytes()[44:] == word['pcm'].tobytes()
+
+def test_parallel_export_matches_sequential_slices(tmp_path, monkeypatch):
+    with open("tests/data/slice/thankyougrandad-3-words/output/output.json", 'r') as f:
+        words = json.load(f) * 10
+    with wave.open("tests/data/slice/thankyougrandad-3-words/input/thankyougrandad-3-words.wav", 'rb') as wav_file:
+        pcm = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+
+    sequential_dir, parallel_dir = tmp_path / "sequential", tmp_path / "parallel"
+    sequential_dir.mkdir()
+    parallel_dir.mkdir()
+    sequential = slice_pcm_blocks([pcm], [dict(word) for word in words], 44100, sequential_dir)
+    parallel = export_pcm_slices_parallel(pcm, [dict(word) for word in words], 44100, parallel_dir, workers=2)
+
+    assert [os.path.basename(word['file_path']) for word in parallel] == [os.path.basename(word['file_path']) for word in sequential]
+    for word in sequential:
+        name = os.path.basename(word['file_path'])
+        assert (parallel_dir / name).read_bytes() == (sequential_dir / name).read_bytes()
+
+    # In-memory slices, as the web app exports them, go through the same worker pool
+    monkeypatch.setattr(slice, "PARALLEL_EXPORT_MIN_SLICES", 2)
+    in_memory_dir = tmp_path / "in-memory"
+    in_memory_dir.mkdir()
+    export_slices(slice_pcm_blocks([pcm], [dict(word) for word in words], 44100), in_memory_dir, workers=2)
+    assert sorted(os.listdir(in_memory_dir)) == sorted(os.listdir(sequential_dir))
+    for name in os.listdir(sequential_dir):
+        assert (in_memory_dir / name).read_bytes() == (sequential_dir / name).read_bytes()
+
+def test_word_stream_is_sliced_as_words_arrive(monkeypatch):
+    with open("tests/data/slice/thankyougrandad-3-words/output/output.json", 'r') as f:
+        words = json.load(f)
+    with wave.open("tests/data/slice/thankyougrandad-3-words/input/thankyougrandad-3-words.wav", 'rb') as wav_file:
+        pcm = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+    # Stands in for ffmpeg decoding the file block by block
+    monkeypatch.setattr(slice, "stream_pcm_blocks", lambda *args: (pcm[i:i + 1000] for i in range(0, len(pcm), 1000)))
+
+    async def transcription():
+        for word in words:
+            await asyncio.sleep(0)
+            yield dict(word)
+
+    async def slice_all():
+        return [word async for word in slice_word_stream("unused.wav", transcription())]
+
+    streamed = asyncio.run(slice_all())
+    expected = slice_pcm_blocks([pcm], [dict(word) for word in words], 44100)
+    assert [word['name'] for word in streamed] == ["0001_Thank", "0002_you", "0003_Grandad"]
+    for word, expected_word in zip(streamed, expected):
+        assert np.array_equal(word['pcm'], expected_word['pcm'])
+
+def test_word_stream_clamps_or_skips_words_that_arrive_late(monkeypatch):
+    pcm = np.arange(44100 * 4, dtype='<i2')
+    monkeypatch.setattr(slice, "stream_pcm_blocks", lambda *args: (pcm[i:i + 1000] for i in range(0, len(pcm), 1000)))
+    words = [{'word': 'one', 'start': 1.0, 'end': 1.5}, {'word': 'gone', 'start': 0.2, 'end': 0.5},
+             {'word': 'overlap', 'start': 0.9, 'end': 1.2}, {'word': 'two', 'start': 3.0, 'end': 3.5}]
+
+    async def transcription():
+        for word in words:
+            yield dict(word)
+
+    async def slice_all():
+        return [word async for word in slice_word_stream("unused.wav", transcription())]
+
+    streamed = asyncio.run(slice_all())
+    assert [word['name'] for word in streamed] == ["0001_one", "0002_overlap", "0003_two"]
+    # The late word is cut from where the audio still available starts
+    assert np.array_equal(streamed[1]['pcm'], pcm[44100:52920])
+    assert np.array_equal(streamed[2]['pcm'], pcm[132300:154350])
@@ -0,0 +1,150 @@
+# content of test_soundfonts.py
+import io
+import json
+import shutil
+import wave
+import pytest
+from pathlib import Path
+from soundfonts import Sample, SoundFont, create_slice_zone, create_slicer_soundfont, create_soundfont, create_sf2_from_json, extract_hex_smpl, index_riff_chunks, rebuild_sf2
+
+SAMPLES_DIR = Path("tests/data/slice/thankyougrandad-3-words/output")
+
+@pytest.fixture
+def samples_dir(tmp_path):
+    samples_dir = tmp_path / "grandad"
+    samples_dir.mkdir()
+    for wav_path in SAMPLES_DIR.glob("*.wav"):
+        shutil.copy(wav_path, samples_dir / wav_path.name)
+    return samples_dir
+
+def test_write_sf2_matches_json_route(samples_dir, tmp_path):
+    sf = create_soundfont(samples_dir, start_note=60)
+
+    direct_path = sf.write_sf2(tmp_path / "direct.sf2")
+    json_path = sf.save(tmp_path)
+    create_sf2_from_json(json_path, tmp_path / "via-json.sf2")
+
+    assert direct_path.read_bytes() == (tmp_path / "via-json.sf2").read_bytes()
+
+def test_in_memory_slices_match_wav_files(samples_dir, tmp_path):
+    words = []
+    for wav_path in sorted(samples_dir.glob("*.wav")):
+        with wave.open(str(wav_path), 'rb') as wav_file:
+            words.append({'name': wav_path.stem, 'pcm': wav_file.readframes(wav_file.getnframes()),
+                          'sample_rate': wav_file.getframerate()})
+
+    from_files = create_soundfont(samples_dir, start_note=60).write_sf2(tmp_path / "from-files.sf2")
+    # As the web app builds its banks, one zone per slice as it comes in
+    sf = create_slicer_soundfont("grandad")
+    for (instrument, key), word_info in zip(sf.lay_out_keys(None, start_note=60), words):
+        instrument.add_zone(create_slice_zone(word_info, key))
+    from_memory = sf.write_sf2(tmp_path / "from-memory.sf2")
+
+    assert from_memory.read_bytes() == from_files.read_bytes()
+
+def test_open_round_trips_written_sf2(samples_dir, tmp_path):
+    sf = create_soundfont(samples_dir, start_note=60)
+    written_path = sf.write_sf2(tmp_path / "written.sf2")
+
+    opened = SoundFont.open(written_path)
+    zones = opened.presets[0].instruments[0].zones
+    assert [zone.sample.name for zone in zones] == ["Grandad", "Thank", "you"]
+    assert [(zone.lower_key, zone.upper_key, zone.root_key) for zone in zones] == [(60, 60, 60), (61, 61, 61), (62, 62, 62)]
+    assert zones[1].sample.pcm == Sample(samples_dir / "Thank.wav").pcm
+
+    rewritten_path = opened.write_sf2(tmp_path / "rewritten.sf2")
+    assert rewritten_path.read_bytes() == written_path.read_bytes()
+
+def test_rebuild_sf2_remaps_keys_and_reuses_sdta(samples_dir, tmp_path):
+    sf2_path = create_soundfont(samples_dir, start_note=60).write_sf2(tmp_path / "grandad.sf2")
+    original_sdta = bytes(index_riff_chunks(memoryview(sf2_path.read_bytes()))["sdta"][0])
+
+    rebuild_sf2(sf2_path, sf2_path, start_note=72)
+
+    remapped = SoundFont.open(sf2_path)
+    zones = remapped.presets[0].instruments[0].zones
+    assert [(zone.lower_key, zone.upper_key, zone.sample.original_pitch) for zone in zones] == [(72, 72, 72), (73, 73, 73), (74, 74, 74)]
+    assert bytes(remapped.source_sdta) == original_sdta
+
+def test_samples_past_note_127_spill_into_more_presets(samples_dir, tmp_path):
+    sf = create_soundfont(samples_dir, start_note=126)
+    opened = SoundFont.open(sf.write_sf2(tmp_path / "grandad.sf2"))
+
+    layout = [(preset.bank, preset.preset, [(zone.sample.name, zone.lower_key) for zone in preset.instruments[0].zones])
+              for preset in opened.presets]
+    assert layout == [(0, 0, [("Grandad", 126), ("Thank", 127)]), (0, 1, [("you", 126)])]
+
+def test_presets_fill_a_bank_before_the_next():
+    sf = SoundFont(name="many", author="", product="", copyright="", comments="")
+    keys = list(sf.lay_out_keys(130, start_note=127))
+
+    assert len(sf.presets) == 130
+    assert [(preset.bank, preset.preset) for preset in sf.presets[126:]] == [(0, 126), (0, 127), (1, 0), (1, 1)]
+    assert all(key == 127 for _, key in keys)
+
+def test_identical_samples_are_stored_once(samples_dir, tmp_path):
+    shutil.copy(samples_dir / "Thank.wav", samples_dir / "Thank-again.wav")
+    sf = create_soundfont(samples_dir, start_note=60)
+    assert len(sf.create_shdr()["entries"]) == 3 + 1
+
+    opened = SoundFont.open(sf.write_sf2(tmp_path / "grandad.sf2"))
+    zones = opened.presets[0].instruments[0].zones
+    assert [(zone.sample.name, zone.root_key) for zone in zones] == [("Grandad", 60), ("Thank-again", 61), ("Thank-again", 62), ("you", 63)]
+    assert zones[1].sample is zones[2].sample
+
+def test_sidecar_json_matches_direct_write(samples_dir, tmp_path):
+    sf = create_soundfont(samples_dir, start_note=60)
+    direct_path = sf.write_sf2(tmp_path / "direct.sf2")
+
+    json_path = sf.save(tmp_path, sidecar=True)
+    assert "data" not in json_path.read_text()
+    assert (tmp_path / "grandad.pcm").exists()
+    create_sf2_from_json(json_path, tmp_path / "via-sidecar.sf2")
+
+    assert direct_path.read_bytes() == (tmp_path / "via-sidecar.sf2").read_bytes()
+
+def test_extract_hex_smpl_across_small_blocks(tmp_path):
+    json_path = tmp_path / "legacy.sf2.json"
+    document = {"contents": [{"id": "LIST", "form_type": "sdta", "contents": {"smpl": {"data": "00017f80fffe"}}}]}
+    json_path.write_text(json.dumps(document, indent=2))
+
+    pcm_file = io.BytesIO()
+    remainder = json.loads(extract_hex_smpl(json_path, pcm_file, block_size=5))
+
+    assert pcm_file.getvalue() == bytes.fromhex("00017f80fffe")
+    assert remainder["contents"][0]["contents"]["smpl"]["data"] == ""
+
+def test_sample_pcm_is_lazy_view_of_wav_data():
+    wav_path = SAMPLES_DIR / "Thank.wav"
+    sample = Sample(wav_path)
+    assert sample._buffer is None
+
+    with wave.open(str(wav_path), 'rb') as wav_file:
+        expected = wav_file.readframes(wav_file.getnframes())
+    assert isinstance(sample.pcm, memoryview)
+    assert sample.pcm == expected
+    assert not hasattr(sample, "__dict__")
+
+def test_large_banks_keep_no_files_open(samples_dir, tmp_path):
+    resource = pytest.importorskip("resource")
+    for i in range(200):
+        shutil.copy(samples_dir / "Thank.wav", samples_dir / f"Thank-{i:03d}.wav")
+    sf = create_soundfont(samples_dir, start_note=0)
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (64, hard))
+    try:
+        sf.write_sf2(tmp_path / "grandad.sf2")
+        sf.save(tmp_path)
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+def test_near_duplicate_fingerprints_are_computed_once(samples_dir, tmp_path, monkeypatch):
+    sf = create_soundfont(samples_dir, start_note=60)
+    sf.near_duplicates = True
+    reads = []
+    read_pcm = Sample.read_pcm
+    monkeypatch.setattr(Sample, "read_pcm", lambda sample: reads.append(sample.name) or read_pcm(sample))
+
+    sf.write_sf2(tmp_path / "grandad.sf2")
+    assert sorted(reads) == ["Grandad", "Thank", "you"]
@@ -0,0 +1,72 @@
+# content of test_staticfiles.py
+import hashlib
+import os
+import time
+import pytest
+from starlette.testclient import TestClient
+import staticfiles
+from serve import app
+
+@pytest.fixture
+def stored_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(staticfiles, "OUTPUT_DIR", tmp_path / "output")
+    monkeypatch.setattr("serve.OUTPUT_DIR", tmp_path / "output")
+    source = tmp_path / "grandad.sf2"
+    source.write_bytes(bytes(range(256)) * 4)
+    return staticfiles.store_static_file(source), source.read_bytes()
+
+def test_download_has_strong_etag_and_revalidates(stored_file):
+    path, contents = stored_file
+    client = TestClient(app)
+
+    response = client.get(f"/{path}")
+    assert response.status_code == 200
+    assert response.content == contents
+    assert response.headers["etag"] == f'"{hashlib.sha256(contents).hexdigest()}"'
+    assert "immutable" in response.headers["cache-control"]
+
+    revalidated = client.get(f"/{path}", headers={"If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+
+def test_first_download_uses_the_etag_computed_while_storing(stored_file, monkeypatch):
+    path, contents = stored_file
+    def hash_file(*args, **kwargs):
+        raise AssertionError("the stored file was hashed again")
+    monkeypatch.setattr(staticfiles, "hash_file", hash_file)
+
+    response = TestClient(app).get(f"/{path}")
+    assert response.status_code == 200
+    assert response.headers["etag"] == f'"{hashlib.sha256(contents).hexdigest()}"'
+
+def test_download_ranges_and_missing_files(stored_file):
+    path, contents = stored_file
+    client = TestClient(app)
+
+    partial = client.get(f"/{path}", headers={"Range": "bytes=10-19"})
+    assert partial.status_code == 206
+    assert partial.content == contents[10:20]
+    assert client.get(f"/{path}", headers={"Range": "bytes=5000-"}).status_code == 416
+
+    assert client.get("/output/no-such-folder/grandad.sf2").status_code == 404
+    assert client.get("/output/..%2Fgrandad.sf2").status_code == 404
+
+def test_least_recently_used_downloads_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(staticfiles, "OUTPUT_DIR", tmp_path / "output")
+    staticfiles.OUTPUT_DIR.mkdir()
+    source = tmp_path / "grandad.sf2"
+    source.write_bytes(bytes(1000))
+
+    paths = []
+    for age in (3, 2, 1):
+        paths.append(tmp_path / staticfiles.store_static_file(source))
+        then = time.time() - age * 60
+        os.utime(paths[-1].parent, (then, then))
+    # The oldest is downloaded, so the second is now the least recently used
+    staticfiles.touch_static_file(paths[0])
+    expired = tmp_path / staticfiles.store_static_file(source)
+    os.utime(expired.parent, (0, 0))
+
+    staticfiles.evict_static_files(max_bytes=2500)
+    assert [path.exists() for path in paths + [expired]] == [True, False, True, False]
@@ -0,0 +1,132 @@
+# content of test_transcribe.py
+import asyncio
+import numpy as np
+import pytest
+import transcribe
+from audioformat import find_silence_splits, write_wav
+from transcribe import ChunkedBackend, StubBackend, stream_transcription, transcribe_audio
+
+AUDIO_PATH = "tests/data/slice/thankyougrandad-3-words/input/thankyougrandad-3-words.wav"
+
+def test_stub_backend_is_deterministic():
+    backend = StubBackend(word_length=0.2, gap=0.1)
+    words = transcribe_audio(AUDIO_PATH, cache=None, backend=backend)
+
+    assert words == transcribe_audio(AUDIO_PATH, cache=None, backend=backend)
+    assert words[:2] == [{'word': 'word1', 'start': 0.0, 'end': 0.2}, {'word': 'word2', 'start': 0.3, 'end': 0.5}]
+    assert StubBackend(words=words).transcribe(AUDIO_PATH) == words
+
+def test_backend_is_chosen_by_environment(monkeypatch):
+    monkeypatch.setattr(transcribe, "_backend", None)
+    monkeypatch.setenv("SLICER_TRANSCRIBER", "stub")
+    assert isinstance(transcribe.get_backend(), StubBackend)
+    assert transcribe.get_backend() is transcribe.get_backend()
+
+    monkeypatch.setattr(transcribe, "_backend", None)
+    monkeypatch.setenv("SLICER_TRANSCRIBER", "nonsense")
+    with pytest.raises(EnvironmentError):
+        transcribe.get_backend()
+
+def test_chunked_backend_stitches_words_at_global_offsets(tmp_path, monkeypatch):
+    # Three one-second tones, each followed by a second of silence
+    sample_rate = 16000
+    tone = (np.sin(np.arange(sample_rate) * 0.1) * 10000).astype('<i2')
+    pcm = np.concatenate([np.concatenate((tone, np.zeros(sample_rate, dtype='<i2'))) for _ in range(3)])
+    audio_path = tmp_path / "tones.wav"
+    write_wav(audio_path, pcm, sample_rate)
+    # Stands in for ffmpeg decoding the file to 16kHz mono block by block
+    decoded_rates = []
+    def stream_pcm_blocks(path, target_rate):
+        decoded_rates.append(target_rate)
+        return (pcm[i:i + 5000] for i in range(0, len(pcm), 5000))
+    monkeypatch.setattr(transcribe, "stream_pcm_blocks", stream_pcm_blocks)
+
+    chunks = find_silence_splits(pcm, sample_rate, chunk_seconds=2, search_seconds=0.5)
+    # Both cuts land in the silences, not in the tones
+    assert len(chunks) == 3
+    assert all(1.1 < (start / sample_rate) % 2 < 1.9 for start, _ in chunks[1:])
+
+    # Every chunk hears a word at its start, plus the overlap from the chunk before
+    inner = StubBackend(words=[{'word': 'overlap', 'start': 0.0, 'end': 0.2}, {'word': 'tone', 'start': 0.3, 'end': 1.3}])
+    backend = ChunkedBackend(inner, chunk_seconds=2, concurrency=3, overlap_seconds=0.3)
+    words = backend.transcribe(audio_path)
+
+    assert [word['word'] for word in words] == ['overlap', 'tone', 'tone', 'tone']
+    assert decoded_rates == [16000]
+    # The later chunks start overlap_seconds early, so their 'tone' starts right at the cut
+    cut_seconds = [start / sample_rate for start, _ in chunks]
+    assert [word['start'] for word in words] == pytest.approx([0.0, 0.3, *cut_seconds[1:]])
+
+def test_chunked_backend_passes_short_audio_straight_through(tmp_path, monkeypatch):
+    pcm = np.zeros(16000 * 2, dtype='<i2')
+    audio_path = tmp_path / "short.wav"
+    write_wav(audio_path, pcm, 16000)
+    monkeypatch.setattr(transcribe, "stream_pcm_blocks", lambda path, target_rate: iter([pcm]))
+    seen = []
+
+    class RecordingBackend(StubBackend):
+        def transcribe(self, file_path):
+            seen.append(file_path)
+            return super().transcribe(file_path)
+
+    words = ChunkedBackend(RecordingBackend(words=[{'word': 'hi', 'start': 0.0, 'end': 0.5}]), chunk_seconds=2).transcribe(audio_path)
+    assert seen == [audio_path]
+    assert words == [{'word': 'hi', 'start': 0.0, 'end': 0.5}]
+
+def test_cancelling_chunked_transcription_cancels_every_chunk(tmp_path, monkeypatch):
+    pcm = np.zeros(16000 * 6, dtype='<i2')
+    audio_path = tmp_path / "silence.wav"
+    write_wav(audio_path, pcm, 16000)
+    monkeypatch.setattr(transcribe, "stream_pcm_blocks", lambda path, target_rate: iter([pcm]))
+    started, cancelled = [], []
+
+    class SlowBackend(StubBackend):
+        async def transcribe_async(self, file_path):
+            started.append(file_path)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(file_path)
+                raise
+
+    backend = ChunkedBackend(SlowBackend(), chunk_seconds=2, concurrency=3)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(backend.transcribe_async(audio_path), 0.5))
+    assert len(started) == 3
+    assert sorted(cancelled) == sorted(started)
+
+def test_async_transcription_retries_timeouts_and_dropped_connections(monkeypatch):
+    monkeypatch.setattr(transcribe, "RETRY_BASE_DELAY", 0.01)
+    failures = [asyncio.sleep(1), ConnectionError("reset")]
+
+    class FlakyBackend(StubBackend):
+        async def transcribe_async(self, file_path):
+            if failures:
+                failure = failures.pop(0)
+                if isinstance(failure, Exception):
+                    raise failure
+                await failure  # outlasts the timeout
+            return await super().transcribe_async(file_path)
+
+    async def transcribe_all(**kwargs):
+        return [word async for word in stream_transcription(AUDIO_PATH, cache=None, backend=backend, **kwargs)]
+
+    backend = FlakyBackend(words=[{'word': 'Thank', 'start': 0.1, 'end': 0.4}])
+    words = asyncio.run(transcribe_all(timeout=0.1, retries=2))
+    assert words == [{'word': 'Thank', 'start': 0.1, 'end': 0.4}]
+    assert not failures
+
+    failures.append(ConnectionError("reset"))
+    with pytest.raises(ConnectionError):
+        asyncio.run(transcribe_all(retries=0))
+
+def test_only_transient_replicate_errors_are_retried():
+    from replicate.exceptions import ModelError, ReplicateError
+
+    assert transcribe.is_retryable(ReplicateError(status=429))
+    assert transcribe.is_retryable(ReplicateError(status=503))
+    assert transcribe.is_retryable(ReplicateError())
+    assert not transcribe.is_retryable(ReplicateError(status=401))
+    assert not transcribe.is_retryable(ReplicateError(status=422))
+    assert not transcribe.is_retryable(ModelError(type("Prediction", (), {'error': "no speech"})()))
+    assert not transcribe.is_retryable(ValueError("Transcription failed"))
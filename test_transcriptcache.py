@@ -0,0 +1,71 @@
+# content of test_transcriptcache.py
+import os
+import time
+import asyncio
+import wave
+import numpy as np
+import slice
+import transcribe
+from storage import hash_file
+from transcriptcache import TranscriptCache
+
+AUDIO_PATH = "tests/data/slice/thankyougrandad-3-words/input/thankyougrandad-3-words.wav"
+WORDS = [{'word': 'Thank', 'start': 0.1, 'end': 0.4}]
+
+def test_cache_hit_skips_replicate(tmp_path, monkeypatch):
+    cache = TranscriptCache(tmp_path)
+    backend = transcribe.ReplicateBackend(proxy_codec=None)
+    calls = []
+    monkeypatch.setenv("REPLICATE_API_TOKEN", "test")
+    monkeypatch.setattr(transcribe.rp, "run", lambda *args, **kwargs: calls.append(args) or {'segments': [{'words': WORDS}]})
+
+    assert transcribe.transcribe_audio(AUDIO_PATH, cache, backend=backend) == WORDS
+    monkeypatch.delenv("REPLICATE_API_TOKEN")
+    assert transcribe.transcribe_audio(AUDIO_PATH, cache, audio_hash=hash_file(AUDIO_PATH), backend=backend) == WORDS
+    assert len(calls) == 1
+
+def test_streamed_transcript_is_cached_without_the_slices(tmp_path, monkeypatch):
+    with wave.open(AUDIO_PATH, 'rb') as wav_file:
+        pcm = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype='<i2')
+    # Stands in for ffmpeg decoding the file block by block
+    monkeypatch.setattr(slice, "stream_pcm_blocks", lambda *args: (pcm[i:i + 1000] for i in range(0, len(pcm), 1000)))
+    cache = TranscriptCache(tmp_path)
+    backend = transcribe.StubBackend(words=WORDS)
+
+    async def slice_transcription():
+        words = transcribe.stream_transcription(AUDIO_PATH, cache, backend=backend)
+        return [word async for word in slice.slice_word_stream(AUDIO_PATH, words)]
+
+    sliced = asyncio.run(slice_transcription())
+    assert len(sliced[0]['pcm']) == 13230
+
+    key = cache.key(hash_file(AUDIO_PATH), backend.model_version, backend.params)
+    assert cache.get(key) == WORDS
+
+def test_key_depends_on_model_and_params():
+    key = TranscriptCache.key("abc", "model:1", {"temperature": 0})
+    assert key == TranscriptCache.key("abc", "model:1", {"temperature": 0})
+    assert key != TranscriptCache.key("abc", "model:2", {"temperature": 0})
+    assert key != TranscriptCache.key("abc", "model:1", {"temperature": 0.2})
+
+def test_least_recently_used_entries_are_evicted_first(tmp_path):
+    cache = TranscriptCache(tmp_path, max_bytes=2 * len('[{"word": "x"}]'))
+    cache.put("a", [{"word": "x"}])
+    cache.put("b", [{"word": "x"}])
+    # Make "a" the oldest entry, then use it so "b" becomes the least recently used
+    past = time.time() - 60
+    os.utime(cache.path("a"), (past, past))
+    os.utime(cache.path("b"), (past + 1, past + 1))
+    assert cache.get("a") is not None
+
+    cache.put("c", [{"word": "x"}])
+    assert [cache.get(key) is not None for key in "abc"] == [True, False, True]
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = TranscriptCache(tmp_path, max_age=10)
+    cache.put("a", WORDS)
+    past = time.time() - 60
+    os.utime(cache.path("a"), (past, past))
+
+    assert cache.get("a") is None
+    assert not cache.path("a").exists()
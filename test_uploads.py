@@ -0,0 +1,53 @@
+# content of test_uploads.py
+import hashlib
+import os
+import shutil
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+from uploads import UploadRejected, receive_upload, sniff_audio_type
+
+AUDIO_PATH = "tests/data/slice/thankyougrandad-3-words/input/thankyougrandad-3-words.wav"
+
+async def upload(request):
+    try:
+        fields, saved = await receive_upload(request, "audio_file", max_bytes=int(request.query_params.get("max", 10**9)))
+    except UploadRejected as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
+    return JSONResponse({"fields": fields, "path": saved.path, "size": saved.size, "sha256": saved.sha256})
+
+client = TestClient(Starlette(routes=[Route("/upload", upload, methods=["POST"])]))
+
+def test_upload_is_saved_under_our_own_name_with_its_hash():
+    with open(AUDIO_PATH, 'rb') as f:
+        audio = f.read()
+    response = client.post("/upload", files={"audio_file": ("../../evil name.wav", audio, "audio/wav")},
+                           data={"start_note": "72"})
+
+    saved = response.json()
+    assert saved["fields"] == {"start_note": "72"}
+    assert os.path.basename(saved["path"]) == "upload.wav"
+    assert saved["size"] == len(audio)
+    assert saved["sha256"] == hashlib.sha256(audio).hexdigest()
+    with open(saved["path"], 'rb') as f:
+        assert f.read() == audio
+    shutil.rmtree(os.path.dirname(saved["path"]))
+
+def test_non_audio_and_oversized_uploads_are_rejected():
+    response = client.post("/upload", files={"audio_file": ("song.wav", b"<html>not audio at all</html>", "audio/wav")})
+    assert response.status_code == 415
+
+    with open(AUDIO_PATH, 'rb') as f:
+        response = client.post("/upload?max=1000", files={"audio_file": ("song.wav", f, "audio/wav")})
+    assert response.status_code == 413
+
+    response = client.post("/upload", content=b"--x--\r\n",
+                           headers={"content-type": "multipart/form-data; boundary=x", "content-length": "lots"})
+    assert response.status_code == 400
+
+def test_sniff_audio_type():
+    assert sniff_audio_type(b"RIFF\x00\x00\x00\x00WAVEfmt ") == ".wav"
+    assert sniff_audio_type(b"ID3\x04\x00") == ".mp3"
+    assert sniff_audio_type(b"\x00\x00\x00\x20ftypM4A ") == ".m4a"
+    assert sniff_audio_type(b"%PDF-1.7") is None
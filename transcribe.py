@@ -1,12 +1,85 @@
 import os
-import replicate as rp
 import json
-def transcribe_audio(file_path):
+import queue
+import random
+import asyncio
+import itertools
+import subprocess
+import tempfile
+import threading
+import wave
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+import numpy as np
+import httpx
+import replicate as rp
+from replicate.exceptions import ReplicateError
+from pydub import AudioSegment
+from pydub.utils import mediainfo
+from audioformat import find_silence_splits, write_wav
+from slice import stream_pcm_blocks
+from storage import hash_file
+from transcriptcache import TranscriptCache
+
+# from https://replicate.com/victor-upmeet/whisperx example code
+MODEL_VERSION = "victor-upmeet/whisperx:84d2ad2d6194fe98a17d2b60bef1c7f910c46b2f6fd38996ca457afd9c8abfcb"
+MODEL_INPUT = {
+    "batch_size": 64,
+    "vad_onset": 0.5,
+    "vad_offset": 0.363,
+    "diarization": False,
+    "temperature": 0,
+    "align_output": True  # Enable word-level timestamps
+}
+
+# WhisperX works on 16kHz mono, so that is all the audio sent for transcription needs to be
+ASR_SAMPLE_RATE = 16000
+ASR_PROXY_CODECS = {
+    "flac": (".flac", ["-c:a", "flac"]),
+    "opus": (".ogg", ["-c:a", "libopus", "-b:a", "32k"]),
+}
+
+# Shared by every transcription in this process; see transcriptcache for where it lives
+TRANSCRIPT_CACHE = TranscriptCache()
+
+# Limits for stream_transcription: seconds per attempt, attempts after the first, and how many
+# transcriptions the process runs at once (the rest wait their turn)
+TRANSCRIBE_TIMEOUT = float(os.getenv("SLICER_TRANSCRIBE_TIMEOUT", 900))
+TRANSCRIBE_RETRIES = int(os.getenv("SLICER_TRANSCRIBE_RETRIES", 2))
+TRANSCRIBE_SLOTS = asyncio.Semaphore(int(os.getenv("SLICER_TRANSCRIBE_MAX_CONCURRENT", 4)))
+RETRY_BASE_DELAY = 1.0
+
+class WorkerExited(Exception):
+    """
+    The WhisperX worker process died in the middle of a transcription. The next transcription
+    starts a new one, so it is worth another attempt; errors the worker reports are not.
+    """
+
+# Failures worth another attempt; anything else (a missing token, audio with no speech, a bug) won't go away.
+# A ModelError is the model itself failing on this audio, so it isn't one of them
+RETRYABLE_ERRORS = (asyncio.TimeoutError, ConnectionError, httpx.TransportError, ReplicateError, WorkerExited)
+
+def is_retryable(error) -> bool:
+    # Replicate answers a bad token, a forbidden model or invalid input with a 4xx that will come
+    # back the same every time; only rate limiting and its own outages are worth waiting out
+    if isinstance(error, ReplicateError):
+        return error.status is None or error.status == 429 or error.status >= 500
+    return isinstance(error, RETRYABLE_ERRORS)
+
+def transcribe_audio(file_path, cache: TranscriptCache = TRANSCRIPT_CACHE, audio_hash: str = None,
+                     backend: "TranscriptionBackend" = None):
     """
-    Transcribes the given WAV file using WhisperX via Replicate and returns an array of words
-    with their start and end times.
+    Transcribes the given WAV file using WhisperX and returns an array of words with their start
+    and end times. The backend doing the work (Replicate by default) is picked by get_backend.
+
+    Transcripts are cached by the audio content hash, model version and input, so the same
+    upload is only ever transcribed once; a cache hit returns without touching the network.
 
     :param file_path: Path to the WAV file to be transcribed.
+    :param cache: Where to look up and keep transcripts, or None to always transcribe.
+    :param audio_hash: The sha256 hex digest of the file, if the caller already has it.
+    :param backend: The backend to transcribe with, instead of the one configured for the process.
     :return: List of dictionaries containing word, start time, and end time.
     
     Response Format:
@@ -25,43 +98,492 @@ def transcribe_audio(file_path):
         {'word': 'is', 'start': 1.6, 'end': 1.7},
         {'word': 'GPT', 'start': 1.8, 'end': 2.0}
     ]
-    """    # This isn't strictly necessary but it's a good way to document the API token
+    """
+    backend = backend or get_backend()
+    if cache is not None:
+        key = cache.key(audio_hash or hash_file(file_path), backend.model_version, backend.params)
+        words = cache.get(key)
+        if words is not None:
+            print(f"Using cached transcript of {file_path} ({len(words)} words)")
+            return words
+
+    words = backend.transcribe(file_path)
+    print(json.dumps(words, indent=2))
+    if cache is not None:
+        cache.put(key, words)
+    return words
+
+async def stream_transcription(file_path, cache: TranscriptCache = TRANSCRIPT_CACHE, audio_hash: str = None,
+                               backend: "TranscriptionBackend" = None, timeout: float = TRANSCRIBE_TIMEOUT,
+                               retries: int = TRANSCRIBE_RETRIES):
+    """
+    The asyncio version of transcribe_audio, for the web server: an async iterator of words that
+    yields each word as soon as the backend has it (chunk by chunk, with ChunkedBackend), so the
+    caller can start work on the first words while later ones are still being transcribed. The
+    event loop is never blocked, so other requests are served while transcriptions are in flight.
+
+    At most SLICER_TRANSCRIBE_MAX_CONCURRENT transcriptions run at once. The timeout is for the
+    transcription as a whole. Attempts that fail in a way that might not happen again (a timeout,
+    a dropped connection, an error from Replicate) before yielding any words are retried up to
+    retries times, after a random delay of up to 1, 2, 4... seconds so that retries from many
+    requests don't arrive together.
+
+    Closing the iterator or cancelling the task (when the job is abandoned, say) stops the
+    transcription; on Replicate the prediction itself is cancelled. The complete transcript is
+    cached once the last word is in.
+    """
+    backend = backend or get_backend()
+    if cache is not None:
+        audio_hash = audio_hash or await asyncio.to_thread(hash_file, file_path)
+        key = cache.key(audio_hash, backend.model_version, backend.params)
+        words = await asyncio.to_thread(cache.get, key)
+        if words is not None:
+            print(f"Using cached transcript of {file_path} ({len(words)} words)")
+            for word_info in words:
+                yield word_info
+            return
+
+    words = []
+    async with TRANSCRIBE_SLOTS:
+        for attempt in range(retries + 1):
+            # The timeout is only enforced while waiting on the backend, so it never cancels
+            # whatever the caller is doing with a word
+            deadline = asyncio.get_running_loop().time() + timeout
+            stream = backend.stream_words(file_path)
+            try:
+                while True:
+                    remaining = deadline - asyncio.get_running_loop().time()
+                    try:
+                        word_info = await asyncio.wait_for(anext(stream), max(remaining, 0))
+                    except StopAsyncIteration:
+                        break
+                    words.append(word_info)
+                    # The caller gets a copy, so whatever it adds to the word (the slicer adds its
+                    # PCM) never ends up in the cache
+                    yield dict(word_info)
+                break
+            except RETRYABLE_ERRORS as e:
+                if words or attempt == retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt)
+                print(f"Transcription of {file_path} failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            finally:
+                await stream.aclose()
+
+    print(f"Transcribed {len(words)} words from {file_path}")
+    if cache is not None:
+        await asyncio.to_thread(cache.put, key, words)
+
+def words_from_segments(segments):
+    """
+    Flattens aligned WhisperX segments into the word list transcribe_audio returns, skipping any
+    word the aligner couldn't place.
+    """
+    words = []
+    for segment in segments:
+        for word_info in segment.get('words', []):
+            if 'start' in word_info and 'end' in word_info:
+                words.append({
+                    'word': word_info['word'].strip(),
+                    'start': word_info['start'],
+                    'end': word_info['end']
+                })
+            else:
+                print(f"Skipping word {word_info['word']} due to missing start or end")
+    return words
+
+class TranscriptionBackend:
+    """
+    Turns an audio file into a word list (see transcribe_audio). model_version and params identify
+    what produced a transcript, and so are part of its cache key.
+    """
+    model_version = None
+    params = {}
+
+    def transcribe(self, file_path):
+        raise NotImplementedError
+
+    async def transcribe_async(self, file_path):
+        # Backends without a native asyncio client transcribe on a thread
+        return await asyncio.to_thread(self.transcribe, file_path)
+
+    async def stream_words(self, file_path):
+        # Backends that only have the whole transcript at the end yield it all at once
+        for word_info in await self.transcribe_async(file_path):
+            yield word_info
+
+    def close(self):
+        pass
+
+class ReplicateBackend(TranscriptionBackend):
+    """
+    Runs WhisperX on Replicate, uploading the audio with every request. Rather than the upload
+    itself, a compact 16kHz mono proxy of it is sent (see asr_proxy), unless proxy_codec is None.
+    """
+    model_version = MODEL_VERSION
+
+    def __init__(self, proxy_codec: str = "flac"):
+        if proxy_codec is not None and proxy_codec not in ASR_PROXY_CODECS:
+            raise ValueError(f"Unknown proxy codec '{proxy_codec}', expected one of {', '.join(ASR_PROXY_CODECS)}")
+        self.proxy_codec = proxy_codec
+        # A lossy proxy could transcribe differently, so it is part of the cache key
+        self.params = MODEL_INPUT if proxy_codec in (None, "flac") else {**MODEL_INPUT, "proxy": proxy_codec}
+
+    def transcribe(self, file_path):
+        check_replicate_api_token()
+
+        # Open the audio file as a binary stream
+        with asr_proxy(file_path, self.proxy_codec) as upload_path, open(upload_path, "rb") as f:
+            prediction = rp.run(
+                self.model_version,
+                input={
+                    "audio_file": f,  # Pass the file directly
+                    **self.params
+                }
+            )
+        return words_from_prediction(prediction)
+
+    async def transcribe_async(self, file_path):
+        check_replicate_api_token()
+
+        with ExitStack() as stack:
+            # Making the proxy runs ffmpeg, so that happens on a thread
+            upload_path = await asyncio.to_thread(stack.enter_context, asr_proxy(file_path, self.proxy_codec))
+            f = stack.enter_context(open(upload_path, "rb"))
+            prediction = await rp.predictions.async_create(
+                version=self.model_version.split(":")[1],
+                input={"audio_file": f, **self.params}
+            )
+            try:
+                await prediction.async_wait()
+            except asyncio.CancelledError:
+                # Nobody is waiting for the result any more, so stop paying for it
+                await asyncio.shield(prediction.async_cancel())
+                raise
+
+        if prediction.status == "failed":
+            raise ValueError(f"Transcription failed: {prediction.error}")
+        return words_from_prediction(prediction.output)
+
+def check_replicate_api_token():
+    # This isn't strictly necessary but it's a good way to document the API token
     replicate_api_token = os.getenv('REPLICATE_API_TOKEN')
     if not replicate_api_token:
         raise EnvironmentError("REPLICATE_API_TOKEN environment variable not set")
 
-    # Open the audio file as a binary stream
-    with open(file_path, "rb") as f:
-        # from https://replicate.com/victor-upmeet/whisperx example code
-        model_version = "victor-upmeet/whisperx:84d2ad2d6194fe98a17d2b60bef1c7f910c46b2f6fd38996ca457afd9c8abfcb"
-        prediction = rp.run(
-            model_version,
-            input={
-                "audio_file": f,  # Pass the file directly
-                "batch_size": 64,
-                "vad_onset": 0.5,
-                "vad_offset": 0.363,
-                "diarization": False,
-                "temperature": 0,
-                "align_output": True  # Enable word-level timestamps
-            }
-        )
-
+def words_from_prediction(prediction):
     # Extract word segments
     if prediction and 'segments' in prediction:
-        words = []
-        for segment in prediction['segments']:
-            for word_info in segment.get('words', []):
-                if 'start' in word_info and 'end' in word_info:
-                    words.append({
-                        'word': word_info['word'].strip(),
-                        'start': word_info['start'],
-                        'end': word_info['end']
-                    })
-                else:
-                    print(f"Skipping word {word_info['word']} due to missing start or end")
-        print(json.dumps(words, indent=2))
-        return words
+        return words_from_segments(prediction['segments'])
     else:
         raise ValueError("Error processing audio file or no segments found.")
 
+@contextmanager
+def asr_proxy(file_path, codec: str = "flac"):
+    """
+    Yields the path of a 16kHz mono proxy of the audio file for transcription, in FLAC or (smaller,
+    but lossy) Opus, and deletes it afterwards. Only the transcription sees the proxy; slicing
+    still uses the original.
+
+    The proxy is only downmixed and resampled, never trimmed or padded, so it spans exactly the
+    same time as the original and the word timestamps it gives need no mapping back. If the proxy
+    comes out no smaller than the original (an upload that is already compressed, say), or codec
+    is None, the original file is yielded instead.
+    """
+    if codec is None:
+        yield file_path
+        return
+
+    suffix, codec_args = ASR_PROXY_CODECS[codec]
+    fd, proxy_path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        subprocess.run([
+            AudioSegment.converter, "-nostdin", "-v", "error", "-y",
+            "-i", str(file_path),
+            "-ac", "1", "-ar", str(ASR_SAMPLE_RATE), *codec_args,
+            proxy_path
+        ], check=True)
+        proxy_size, original_size = os.path.getsize(proxy_path), os.path.getsize(file_path)
+        if proxy_size < original_size:
+            print(f"Transcribing a {codec} proxy of {file_path}: {proxy_size} bytes instead of {original_size}")
+            yield proxy_path
+        else:
+            yield file_path
+    finally:
+        os.unlink(proxy_path)
+
+class WhisperXBackend(TranscriptionBackend):
+    """
+    Runs WhisperX locally in a long-lived worker process, which loads the model once when the
+    backend is created and then serves transcriptions from a queue, so no request pays for the
+    network or for loading the model. Works offline and on CPU, where it uses float32.
+
+    Requests are served one at a time in the order they arrive; transcribe blocks until its own
+    result comes back. A worker that dies is replaced on the next request.
+    """
+    def __init__(self, model_name: str = "medium", device: str = None, batch_size: int = 16, language: str = None):
+        self.model_version = f"whisperx:{model_name}"
+        self.params = {"batch_size": batch_size, "language": language, "align_output": True}
+        self.worker_args = (model_name, device, batch_size, language)
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.start_worker()
+
+    def start_worker(self):
+        # spawn rather than fork, so the worker starts clean of the server's threads and sockets
+        context = multiprocessing.get_context("spawn")
+        self.requests = context.Queue()
+        self.responses = context.Queue()
+        self.process = context.Process(
+            target=run_whisperx_worker,
+            args=(self.requests, self.responses, *self.worker_args),
+            daemon=True
+        )
+        self.process.start()
+
+    def transcribe(self, file_path):
+        with self.lock:
+            if not self.process.is_alive():
+                # The last one died (out of memory, say); the transcription is tried on a new one
+                print(f"WhisperX worker exited (exit code {self.process.exitcode}), starting another")
+                self.start_worker()
+            request_id = next(self.request_ids)
+            self.requests.put((request_id, os.path.abspath(file_path)))
+            while True:
+                try:
+                    response_id, words, error = self.responses.get(timeout=1)
+                except queue.Empty:
+                    if not self.process.is_alive():
+                        raise WorkerExited(f"WhisperX worker exited (exit code {self.process.exitcode})")
+                    continue
+                if response_id == request_id:
+                    break
+        if error:
+            raise ValueError(f"Error transcribing {file_path}: {error}")
+        return words
+
+    def close(self):
+        if self.process.is_alive():
+            self.requests.put(None)
+            self.process.join(timeout=10)
+        if self.process.is_alive():
+            self.process.terminate()
+
+def run_whisperx_worker(requests, responses, model_name, device, batch_size, language):
+    # Runs in the worker process. torch and whisperx are only needed here, so only imported here
+    import torch
+    import whisperx
+
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    compute_type = "float16" if device == "cuda" else "float32"
+    print(f"Loading Whisper model {model_name} on {device}...")
+    model = whisperx.load_model(model_name, device, compute_type=compute_type, language=language)
+    align_models = {}  # loaded on first use of each language, then kept
+
+    while (request := requests.get()) is not None:
+        request_id, file_path = request
+        try:
+            audio = whisperx.load_audio(file_path)
+            result = model.transcribe(audio, batch_size=batch_size)
+            if result["language"] not in align_models:
+                align_models[result["language"]] = whisperx.load_align_model(language_code=result["language"], device=device)
+            model_a, metadata = align_models[result["language"]]
+            aligned = whisperx.align(result["segments"], model_a, metadata, audio, device)
+            responses.put((request_id, words_from_segments(aligned["segments"]), None))
+        except Exception as e:
+            responses.put((request_id, None, f"{type(e).__name__}: {e}"))
+
+class ChunkedBackend(TranscriptionBackend):
+    """
+    Wraps another backend to transcribe long audio as a number of chunks at once. The audio is
+    decoded at 16kHz mono, cut at pauses near every chunk_seconds (see
+    audioformat.find_silence_splits), and up to concurrency chunks are transcribed at a time, so
+    an hour of audio takes about as long as its slowest chunk. A chunk that fails is retried
+    before the transcription as a whole gives up.
+
+    Each chunk is sent with overlap_seconds of its neighbours on either side, so a word cut at the
+    edge is still heard whole, and a word is only kept by the chunk its middle falls in, so words in
+    the overlap aren't kept twice. Word times are shifted by the chunk's offset into the audio.
+    Audio shorter than one and a half chunks is passed straight to the wrapped backend.
+    """
+    def __init__(self, backend: TranscriptionBackend, chunk_seconds: float = 120, concurrency: int = 4,
+                 overlap_seconds: float = 0.5, retries: int = 2):
+        self.backend = backend
+        self.chunk_seconds = chunk_seconds
+        self.concurrency = concurrency
+        self.overlap_seconds = overlap_seconds
+        self.retries = retries
+        self.model_version = backend.model_version
+        # Chunk boundaries can change what is heard, so the chunking is part of the cache key
+        self.params = {**backend.params, "chunk_seconds": chunk_seconds, "overlap_seconds": overlap_seconds}
+
+    def transcribe(self, file_path):
+        pcm, sample_rate, chunks = self.split(file_path)
+        if chunks is None:
+            return self.backend.transcribe(file_path)
+
+        with tempfile.TemporaryDirectory() as chunk_dir:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                chunk_words = list(pool.map(lambda index: self.transcribe_chunk(chunk_dir, pcm, sample_rate, chunks, index),
+                                            range(len(chunks))))
+        return [word_info for words in chunk_words for word_info in words]
+
+    async def transcribe_async(self, file_path):
+        return [word_info async for word_info in self.stream_words(file_path)]
+
+    async def stream_words(self, file_path):
+        # As transcribe, but the words of each chunk are yielded as soon as it and every chunk
+        # before it are done, rather than once the last chunk is. The chunks are transcribed with
+        # the wrapped backend's transcribe_async, so cancelling this cancels every chunk in flight
+        # (on Replicate, the predictions themselves)
+        pcm, sample_rate, chunks = await asyncio.to_thread(self.split, file_path)
+        if chunks is None:
+            async for word_info in self.backend.stream_words(file_path):
+                yield word_info
+            return
+
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def transcribe_chunk(index):
+            async with slots:
+                return await self.transcribe_chunk_async(chunk_dir, pcm, sample_rate, chunks, index)
+
+        with tempfile.TemporaryDirectory() as chunk_dir:
+            tasks = [asyncio.ensure_future(transcribe_chunk(index)) for index in range(len(chunks))]
+            try:
+                for task in tasks:
+                    for word_info in await task:
+                        yield word_info
+            finally:
+                for task in tasks:
+                    task.cancel()
+                # Let the cancelled chunks finish cancelling before their files are removed
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def split(self, file_path):
+        # ffmpeg decodes straight to 16kHz mono 16-bit, so the whole recording is only ever held in
+        # the form transcription needs: about 110MB an hour. Its length also decides whether chunking
+        # is worth it, so nothing else has to decode the file just to learn its duration
+        sample_rate = ASR_SAMPLE_RATE
+        pcm = np.concatenate([*stream_pcm_blocks(file_path, target_rate=sample_rate), np.zeros(0, dtype='<i2')])
+        if len(pcm) < 1.5 * self.chunk_seconds * sample_rate:
+            return pcm, sample_rate, None
+        chunks = find_silence_splits(pcm, sample_rate, self.chunk_seconds, search_seconds=min(10, self.chunk_seconds / 4))
+        print(f"Transcribing {file_path} as {len(chunks)} chunks, {self.concurrency} at a time")
+        return pcm, sample_rate, chunks
+
+    def transcribe_chunk(self, chunk_dir, pcm, sample_rate, chunks, index):
+        chunk_path, offset = self.write_chunk(chunk_dir, pcm, sample_rate, chunks, index)
+        for attempt in range(self.retries + 1):
+            try:
+                words = self.backend.transcribe(chunk_path)
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.retries or not is_retryable(e):
+                    raise
+                print(f"Retrying chunk {index + 1} after error: {e}")
+        return self.keep_chunk_words(words, offset, sample_rate, chunks, index)
+
+    async def transcribe_chunk_async(self, chunk_dir, pcm, sample_rate, chunks, index):
+        chunk_path, offset = await asyncio.to_thread(self.write_chunk, chunk_dir, pcm, sample_rate, chunks, index)
+        for attempt in range(self.retries + 1):
+            try:
+                words = await self.backend.transcribe_async(chunk_path)
+                break
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.retries or not is_retryable(e):
+                    raise
+                print(f"Retrying chunk {index + 1} after error: {e}")
+        return self.keep_chunk_words(words, offset, sample_rate, chunks, index)
+
+    def write_chunk(self, chunk_dir, pcm, sample_rate, chunks, index):
+        # Writes the chunk with its overlap to a WAV file, returning its path and offset in seconds
+        start, end = chunks[index]
+        overlap = int(self.overlap_seconds * sample_rate)
+        padded_start, padded_end = max(start - overlap, 0), min(end + overlap, len(pcm))
+        chunk_path = os.path.join(chunk_dir, f"{index:04d}.wav")
+        write_wav(chunk_path, pcm[padded_start:padded_end], sample_rate)
+        return chunk_path, padded_start / sample_rate
+
+    @staticmethod
+    def keep_chunk_words(words, offset, sample_rate, chunks, index):
+        # Shift into the whole recording's time, keeping only the words centred in this chunk
+        start, end = chunks[index]
+        kept = []
+        for word_info in words:
+            word_info = {**word_info, 'start': word_info['start'] + offset, 'end': word_info['end'] + offset}
+            middle = (word_info['start'] + word_info['end']) / 2 * sample_rate
+            if start <= middle < end or (index == len(chunks) - 1 and middle >= start):
+                kept.append(word_info)
+        return kept
+
+    def close(self):
+        self.backend.close()
+
+class StubBackend(TranscriptionBackend):
+    """
+    A deterministic stand-in for tests and offline development: given a list of words it always
+    returns (copies of) those, otherwise it fills the audio with 'word1', 'word2'... of
+    word_length seconds each, separated by gap seconds of silence.
+    """
+    model_version = "stub"
+
+    def __init__(self, words=None, word_length: float = 0.25, gap: float = 0.05):
+        self.words = words
+        self.word_length = word_length
+        self.gap = gap
+        self.params = {"word_length": word_length, "gap": gap}
+
+    def transcribe(self, file_path):
+        if self.words is not None:
+            return [dict(word) for word in self.words]
+        duration = audio_duration(file_path)
+        words = []
+        start = 0.0
+        while start + self.word_length <= duration:
+            words.append({'word': f"word{len(words) + 1}", 'start': round(start, 3), 'end': round(start + self.word_length, 3)})
+            start += self.word_length + self.gap
+        return words
+
+def audio_duration(file_path) -> float:
+    try:
+        with wave.open(str(file_path), 'rb') as wav_file:
+            return wav_file.getnframes() / wav_file.getframerate()
+    except wave.Error:
+        # ffprobe reads the duration from the container instead of decoding the whole file
+        return float(mediainfo(str(file_path))['duration'])
+
+BACKENDS = {
+    "replicate": lambda: ReplicateBackend(os.getenv("SLICER_ASR_PROXY", "flac") or None),
+    "whisperx": lambda: WhisperXBackend(os.getenv("SLICER_WHISPERX_MODEL", "medium")),
+    "stub": StubBackend,
+}
+
+_backend = None
+
+def create_backend() -> TranscriptionBackend:
+    name = os.getenv("SLICER_TRANSCRIBER", "replicate")
+    if name not in BACKENDS:
+        raise EnvironmentError(f"Unknown SLICER_TRANSCRIBER '{name}', expected one of {', '.join(BACKENDS)}")
+    backend = BACKENDS[name]()
+    chunk_seconds = float(os.getenv("SLICER_TRANSCRIBE_CHUNK_SECONDS", 0))
+    if chunk_seconds > 0:
+        backend = ChunkedBackend(backend, chunk_seconds, int(os.getenv("SLICER_TRANSCRIBE_CONCURRENCY", 4)))
+    return backend
+
+def get_backend() -> TranscriptionBackend:
+    """
+    Returns the transcription backend for this process, creating it on first use from the
+    SLICER_TRANSCRIBER environment variable: 'replicate' (the default), 'whisperx' or 'stub'.
+    For Replicate, SLICER_ASR_PROXY picks the proxy codec ('flac' by default, 'opus'), or set it
+    empty to upload the original file. Setting SLICER_TRANSCRIBE_CHUNK_SECONDS transcribes long
+    audio in chunks of about that many seconds, SLICER_TRANSCRIBE_CONCURRENCY (4 by default) at
+    a time; see ChunkedBackend.
+    Call it at startup to have a local model loaded before the first request comes in.
+    """
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
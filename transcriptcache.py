@@ -0,0 +1,74 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+from pathlib import Path
+from storage import evict_least_recently_used
+
+# Where transcripts are kept between runs, unless SLICER_TRANSCRIPT_CACHE_DIR says otherwise
+CACHE_DIR = Path(os.getenv("SLICER_TRANSCRIPT_CACHE_DIR", Path.home() / ".cache" / "audioslicer" / "transcripts"))
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_MAX_AGE = 30 * 24 * 60 * 60  # seconds since an entry was last used
+
+
+class TranscriptCache:
+    """
+    An on-disk cache of transcripts, one JSON file per entry, keyed by the audio content hash plus
+    the model version and input parameters that produced it.
+
+    Entries are written to a temporary file and renamed into place, so a reader never sees a half
+    written entry, even with several processes sharing the directory. Every hit touches the
+    entry's modification time, which makes it the last-used time that eviction goes by: entries
+    unused for max_age seconds are dropped, then the least recently used until the cache fits in
+    max_bytes.
+    """
+    def __init__(self, directory: Path = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES, max_age: float = CACHE_MAX_AGE):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    @staticmethod
+    def key(audio_hash: str, model_version: str, params: dict) -> str:
+        document = json.dumps({"audio": audio_hash, "model": model_version, "params": params}, sort_keys=True)
+        return hashlib.sha256(document.encode()).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str):
+        """
+        Returns the cached words for key, or None if there are none (or they have expired).
+        """
+        path = self.path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                return None
+            words = json.loads(path.read_text())
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return words
+
+    def put(self, key: str, words):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(words, f)
+            os.replace(temp_path, self.path(key))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # evicted by another process
+            entries.append((stat.st_mtime, stat.st_size, path))
+        evict_least_recently_used(entries, self.max_bytes, self.max_age, lambda path: path.unlink(missing_ok=True))
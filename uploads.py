@@ -0,0 +1,178 @@
+import os
+import shutil
+import hashlib
+import tempfile
+from python_multipart.multipart import MultipartParser, parse_options_header
+from scratch import SCRATCH_PREFIX
+
+# Uploads larger than this are rejected as soon as they pass it, SLICER_MAX_UPLOAD_MB to change
+MAX_UPLOAD_BYTES = int(os.getenv("SLICER_MAX_UPLOAD_MB", 200)) * 1024 * 1024
+# Form fields other than the file are small; anything bigger is not from our form
+MAX_FIELD_BYTES = 1024
+# Enough of the start of a file to recognise every format in sniff_audio_type
+SNIFF_BYTES = 16
+
+
+class UploadRejected(Exception):
+    """
+    The upload can't be accepted; status_code is the HTTP status to answer with.
+    """
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Upload:
+    """
+    An uploaded file saved to scratch storage, with its size and sha256 hex digest (which the
+    transcript cache can use as is). filename is what the client called it, for display only.
+    """
+    __slots__ = ("path", "filename", "size", "sha256")
+
+    def __init__(self, path: str, filename: str, size: int, sha256: str):
+        self.path = path
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+
+
+def sniff_audio_type(head: bytes):
+    """
+    Recognises the audio container formats browsers and recorders produce from the first bytes
+    of a file, returning the usual file extension, or None if it isn't audio we know.
+    """
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return ".wav"
+    if head[:4] == b'FORM' and head[8:12] in (b'AIFF', b'AIFC'):
+        return ".aiff"
+    if head[:4] == b'fLaC':
+        return ".flac"
+    if head[:4] == b'OggS':
+        return ".ogg"
+    if head[:4] == b'\x1aE\xdf\xa3':
+        return ".webm"  # Matroska, as recorded by MediaRecorder
+    if head[4:8] == b'ftyp':
+        return ".m4a"
+    if head[:3] == b'ID3':
+        return ".mp3"
+    if len(head) >= 2 and head[0] == 0xFF:
+        if head[1] & 0xF6 == 0xF0:
+            return ".aac"  # ADTS
+        if head[1] & 0xE0 == 0xE0:
+            return ".mp3"  # MPEG audio frame sync
+    return None
+
+
+async def receive_upload(request, file_field: str = "audio_file", max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    Reads a multipart/form-data request straight off the connection, streaming the file in
+    file_field to a new scratch directory chunk by chunk as it arrives, so even a large upload
+    never sits in memory. The file's sha256 is computed on the way through.
+
+    The upload is rejected (UploadRejected, with the file removed) as soon as it is known to be
+    bad: a Content-Length over max_bytes before anything is read, more than max_bytes of file
+    while streaming, or a file that doesn't start like any audio format sniff_audio_type knows.
+    The file is saved under a name of our own, never the client's.
+
+    :return: The other form fields, as a dict of strings, and the Upload (None if there was no file).
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected("Expected a multipart/form-data upload", 400)
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        try:
+            content_length = int(content_length)
+        except ValueError:
+            raise UploadRejected("Invalid Content-Length header", 400) from None
+    if content_length is not None and content_length > max_bytes + 64 * 1024:
+        raise UploadRejected(f"Upload is larger than {max_bytes // (1024 * 1024)} MB", 413)
+
+    fields = {}
+    upload_dir = tempfile.mkdtemp(prefix=SCRATCH_PREFIX)
+    state = {"header_field": b"", "header_value": b"", "headers": {}, "name": None, "file": None, "head": b"",
+             "size": 0, "filename": None, "path": None, "sha256": None}
+    digest = hashlib.sha256()
+
+    def on_part_begin():
+        state["headers"] = {}
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"] = state["header_value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        state["name"] = disposition.get(b"name", b"").decode("utf-8", "replace")
+        if state["name"] == file_field and b"filename" in disposition:
+            state["filename"] = disposition[b"filename"].decode("utf-8", "replace")
+            state["head"] = b""
+        else:
+            fields[state["name"]] = ""
+
+    def start_file():
+        # Only once the first bytes show it is audio is anything written to disk
+        extension = sniff_audio_type(state["head"])
+        if extension is None:
+            raise UploadRejected("That doesn't look like an audio file", 415)
+        state["path"] = os.path.join(upload_dir, f"upload{extension}")
+        state["file"] = open(state["path"], "wb")
+        write_file(state["head"])
+
+    def write_file(data):
+        state["size"] += len(data)
+        if state["size"] > max_bytes:
+            raise UploadRejected(f"Upload is larger than {max_bytes // (1024 * 1024)} MB", 413)
+        digest.update(data)
+        state["file"].write(data)
+
+    def on_part_data(data, start, end):
+        data = data[start:end]
+        if state["name"] != file_field or state["filename"] is None:
+            if len(fields[state["name"]]) + len(data) > MAX_FIELD_BYTES:
+                raise UploadRejected(f"Form field '{state['name']}' is too long", 400)
+            fields[state["name"]] += data.decode("utf-8", "replace")
+        elif state["file"] is None:
+            state["head"] += data
+            if len(state["head"]) >= SNIFF_BYTES:
+                start_file()
+        else:
+            write_file(data)
+
+    def on_part_end():
+        if state["name"] == file_field and state["filename"] is not None:
+            if state["file"] is None and state["head"]:
+                start_file()  # a file shorter than SNIFF_BYTES
+            if state["file"] is not None:
+                state["file"].close()
+                state["sha256"] = digest.hexdigest()
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except BaseException:
+        if state["file"] is not None:
+            state["file"].close()
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        raise
+
+    if state["sha256"] is None:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return fields, None
+    return fields, Upload(state["path"], state["filename"], state["size"], state["sha256"])